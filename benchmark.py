@@ -0,0 +1,159 @@
+'''
+Benchmark of the CGOO import path on an offline stand-in of CGOO
+
+A synthetic history is generated for the tags matched to the given HL ids,
+then the backfill and run_module are timed against it:
+
+    python benchmark.py --ids HL000562 HL000564 --days 365 --step 15
+'''
+import os
+os.environ.setdefault('RAISE', '0')
+
+import time                                               # noqa
+import logging                                            # noqa
+import argparse                                           # noqa
+import contextlib                                         # noqa
+import tempfile                                           # noqa
+import datetime as dt                                     # noqa
+from pathlib import Path                                  # noqa
+
+import pandas as pd  # noqa
+
+from fews_spoccer.utils import profile                                          # noqa
+from fews_spoccer.spoc.spoccer import Spoccer                                   # noqa
+from fews_spoccer.modules.imports.offline import (                              # noqa
+    OfflineCGOO, OfflineOpvlWaterModule, generate_history)
+
+
+logger = logging.getLogger('fews_spoccer.modules.benchmark')
+
+read_kw = {
+    'sep': ';',
+    'index_col': False,
+    'dtype': object,
+    'na_values': [''],
+    'keep_default_na': False,
+    'encoding': 'cp1252',
+}
+write_kw = {
+    'sep': ';',
+    'index': False,
+    'encoding': 'cp1252'
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--ids', nargs='+', default=['HL000562', 'HL000564'])
+    parser.add_argument('--srcdir', default='./tests/data/maplayerfiles')
+    parser.add_argument('--h2godir', default='./tests/data/imports')
+    parser.add_argument('--sync-column', default='oc_test')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--step', type=int, default=15, help='minutes')
+    parser.add_argument('--gaps', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--h2go-workers', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('--store', action='store_true')
+    parser.add_argument('--profile', type=int, default=0,
+                        help='log the top calls of run_module')
+    return parser.parse_args()
+
+
+def location_tags(spoccer, ids) -> dict:
+    '''Tags per location matched to the sublocations of ids'''
+    tags = {}
+    for id in ids:
+        matches = spoccer.hl.param_matches(spoccer.hl.sublocations(id))
+        for tag, location in matches.df[['tag', 'location']].dropna()\
+                .itertuples(index=False):
+            tags.setdefault(location, set()).add(tag)
+    return {location: sorted(t) for location, t in tags.items()}
+
+
+def cgoo_config(tmpdir, args, store='store.db') -> dict:
+    return {
+        'dstpath': tmpdir / 'imports',
+        'credentials': {'database': tmpdir / 'history.db'},
+        'write_kw': {'index': False},
+        'concurrency': args.concurrency,
+        'streaming': args.streaming,
+        'storepath': tmpdir / store if args.store else None,
+        }
+
+
+def benchmark_backfill(tmpdir, args, tags) -> pd.Series:
+    '''Windows and rows per second of a full backfill per location'''
+    cgoo = OfflineCGOO(**cgoo_config(tmpdir, args))
+    cgoo.connect()
+
+    t = time.perf_counter()
+    cgoo.map(cgoo.get_timeseries, list(tags))
+    seconds = time.perf_counter() - t
+
+    stats = cgoo.stats()
+    return pd.Series({
+        'locations': len(stats),
+        'windows': stats.windows.sum(),
+        'rows': stats.rows.sum(),
+        'seconds': seconds,
+        'windows/s': stats.windows.sum() / seconds,
+        'rows/s': stats.rows.sum() / seconds,
+        })
+
+
+def benchmark_run_module(tmpdir, args) -> pd.Series:
+    '''Wall time of run_module per id on a freshly loaded tree'''
+    spoccer = Spoccer(args.srcdir, tmpdir / 'maplayerfiles', read_kw,
+                      write_kw)
+    spoccer.load()
+    spoccer.load_module(
+        OfflineOpvlWaterModule,
+        h2go_config={
+            'srcpath': args.h2godir,
+            'dstpath': tmpdir / 'imports',
+            'read_kw': {},
+            'write_kw': {'index': False},
+            },
+        cgoo_config=cgoo_config(tmpdir, args, store='store_run.db'),
+        h2go_workers=args.h2go_workers)
+
+    seconds = {}
+    with profile(logger, top=args.profile) if args.profile else \
+            contextlib.nullcontext():
+        for id in args.ids:
+            t = time.perf_counter()
+            spoccer.run_module(id, args.sync_column)
+            seconds[id] = time.perf_counter() - t
+    return pd.Series(seconds, name='seconds')
+
+
+def main():
+    args = parse_args()
+    enddatetime = dt.datetime.now().replace(microsecond=0)
+    startdatetime = enddatetime - dt.timedelta(days=args.days)
+    OfflineCGOO.global_startdatetime = startdatetime
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        for subdir in ('imports', 'maplayerfiles'):
+            (tmpdir / subdir).mkdir()
+
+        spoccer = Spoccer(args.srcdir, tmpdir, read_kw, write_kw)
+        spoccer.load()
+        tags = location_tags(spoccer, args.ids)
+
+        t = time.perf_counter()
+        rows = generate_history(
+            tmpdir / 'history.db', tags, startdatetime, enddatetime,
+            step=dt.timedelta(minutes=args.step), gaps=args.gaps)
+        print(f'generated {rows} rows for {sum(map(len, tags.values()))} '
+              f'tags at {len(tags)} locations in '
+              f'{time.perf_counter() - t:.2f}s')
+
+        print(benchmark_backfill(tmpdir, args, tags).to_string())
+        print(benchmark_run_module(tmpdir, args).to_string())
+
+
+if __name__ == '__main__':
+    main()
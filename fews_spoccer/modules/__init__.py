@@ -1,4 +1,6 @@
+import os
 import logging
+import multiprocessing
 
 
 def add_loghandler(logger, handler, loglevel, formatter, **kwargs):
@@ -12,17 +14,19 @@ def add_loghandler(logger, handler, loglevel, formatter, **kwargs):
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
+logger.setLevel(os.environ.get('LOGLEVEL', 'DEBUG'))  # $env:LOGLEVEL='INFO'
 
 fmt_file = logging.Formatter(
     '%(asctime)s - %(levelname)s - %(message)s')
 fmt_stream = logging.Formatter(
     '%(levelname)s - %(message)s')
 
-add_loghandler(
-    logger, logging.FileHandler, logging.DEBUG, fmt_file,
-    filename='./module.log', mode='w')
-add_loghandler(
-    logger, logging.StreamHandler, logging.INFO, fmt_stream)
+# worker processes would truncate the log, their errors reach the parent
+if multiprocessing.current_process().name == 'MainProcess':
+    add_loghandler(
+        logger, logging.FileHandler, logging.DEBUG, fmt_file,
+        filename='./module.log', mode='w')
+    add_loghandler(
+        logger, logging.StreamHandler, logging.INFO, fmt_stream)
 
 logger.debug(__name__)
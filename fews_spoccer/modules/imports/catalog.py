@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+import datetime as dt
+from pathlib import Path
+from contextlib import contextmanager
+
+from ...utils import log
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def file_lock(path, timeout=60, stale=600, poll=0.05):
+    '''
+    Exclusive lock between processes by creating path
+
+    Waits until timeout, a lock older than stale seconds is left by a
+    crashed process and taken over.
+    '''
+    path = Path(path)
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except FileExistsError:
+            try:
+                age = time.time() - path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if age > stale:
+                logger.warning(f'{path.name} - stale lock removed')
+                path.unlink(missing_ok=True)
+            elif time.monotonic() > deadline:
+                raise TimeoutError(f'{path} is locked')
+            else:
+                time.sleep(poll)
+    try:
+        yield
+    finally:
+        path.unlink(missing_ok=True)
+
+
+class TagCatalog:
+    '''
+    Available CGOO tags per location
+
+    Entries expire after ttl. With a path the catalog is persisted as
+    json and shared between runs and processes, saving merges with the
+    entries on disk and keeps the most recent entry per location. Saves
+    are locked against other processes and skipped without new entries.
+
+    The earliest timestamp per tag of a location, known once a backfill
+    ran dry, does not expire.
+    '''
+    def __init__(self, path=None, ttl=dt.timedelta(days=1)):
+        self.path = Path(path) if path else None
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._entries, self._earliest = self.read()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def lockpath(self):
+        return self.path.with_name(self.path.name + '.lock')
+
+    def read(self) -> tuple[dict, dict]:
+        '''
+        Entries on disk as {location: (fetched, tags)} and earliest
+        timestamps as {location: {tag: datetime or None}}
+        '''
+        if self.path is None:
+            return {}, {}
+        try:
+            data = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return {}, {}
+        entries = {location: (entry['fetched'], set(entry['tags']))
+                   for location, entry in data.items()}
+        earliest = {
+            location: {tag: t and dt.datetime.fromisoformat(t)
+                       for tag, t in entry['earliest'].items()}
+            for location, entry in data.items() if 'earliest' in entry}
+        return entries, earliest
+
+    def is_fresh(self, fetched) -> bool:
+        return time.time() - fetched < self.ttl.total_seconds()
+
+    def get(self, location) -> set | None:
+        '''Tags of a location, None if unknown or expired'''
+        entry = self._entries.get(location)
+        if entry is not None and self.is_fresh(entry[0]):
+            return entry[1]
+        return None
+
+    def missing(self, locations) -> list:
+        return [location for location in dict.fromkeys(locations)
+                if self.get(location) is None]
+
+    def put(self, location, tags):
+        with self._lock:
+            self._entries[location] = (time.time(), set(tags))
+            self._dirty = True
+
+    @staticmethod
+    def merge_earliest(earliest, other) -> dict:
+        '''Earliest timestamps per tag of both, None if neither has one'''
+        merged = dict(earliest)
+        for tag, datetime in other.items():
+            known = [t for t in (merged.get(tag), datetime) if t is not None]
+            merged[tag] = min(known) if known else None
+        return merged
+
+    def earliest(self, location):
+        '''Earliest timestamp of any tag at location, if known for all'''
+        earliest = self._earliest.get(location)
+        if earliest and None not in earliest.values():
+            return min(earliest.values())
+
+    def set_earliest(self, location, tags, earliest):
+        '''Record the earliest timestamp of tags once a backfill ran dry'''
+        with self._lock:
+            self._earliest[location] = self.merge_earliest(
+                self._earliest.get(location, {}),
+                {tag: earliest.get(tag) for tag in tags})
+            self._dirty = True
+
+    @log(logger)
+    def save(self):
+        if self.path is None or not self._dirty:
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, file_lock(self.lockpath):
+            entries, earliest = self.read()
+            for location, entry in self._entries.items():
+                if location not in entries or entries[location][0] < entry[0]:
+                    entries[location] = entry
+            for location, tags in self._earliest.items():
+                earliest[location] = self.merge_earliest(
+                    earliest.get(location, {}), tags)
+            self._entries, self._earliest = entries, earliest
+            self._dirty = False
+
+            data = {location: {'fetched': fetched, 'tags': sorted(tags)}
+                    for location, (fetched, tags) in entries.items()
+                    if self.is_fresh(fetched)}
+            for location, tags in earliest.items():
+                data.setdefault(location, {'fetched': 0, 'tags': []})
+                data[location]['earliest'] = {
+                    tag: t and t.isoformat() for tag, t in tags.items()}
+
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
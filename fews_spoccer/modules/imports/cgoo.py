@@ -1,27 +1,111 @@
 import time
+import queue
 import logging
-import functools
+import tempfile
+import threading
+import contextvars
 import datetime as dt
 from pathlib import Path
-
-import pyodbc
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyodbc
+except ImportError:                 # offline use, see offline.OfflineCGOO
+    pyodbc = None
+import numpy as np
 import pandas as pd
 
-from ...utils import catch, log
+from .store import TimeseriesStore
+from .catalog import TagCatalog
+from ...utils import catch, log, scratch, mkstemp, replace
 from ...spoc.etypes import MutedTagException, TagNotInViewException
 
 
 logger = logging.getLogger(__name__)
 
 
-class CGOOBase:
-    '''Connect to CGOO database'''
+class TokenBucket:
+    '''
+    Rate limiter for queries
+
+    Holds up to capacity tokens, refilled at rate tokens per second.
+    A rate of None or 0 does not limit.
+    '''
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(rate={self.rate})'
+
+    def acquire(self):
+        '''Wait for and take one token'''
+        if not self.rate:
+            return
 
-    def __init__(self, credentials):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity,
+                    self._tokens + (now - self._last) * self.rate)
+                self._last = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Partition:
+    '''
+    Timeseries sorted once by TagName and DateTime
+
+    A tag and period are sliced with searchsorted instead of filtering
+    and sorting the whole DataFrame per tag.
+    '''
+    def __init__(self, df):
+        self.df = df.sort_values(['TagName', 'DateTime'], kind='stable')
+        self.tagnames = self.df.TagName.to_numpy()
+        self.datetimes = self.df.DateTime.to_numpy()
+
+    def select(self, tagname, after=None) -> pd.DataFrame:
+        '''Rows of tagname with DateTime after a datetime'''
+        lo = self.tagnames.searchsorted(tagname, 'left')
+        hi = self.tagnames.searchsorted(tagname, 'right')
+        if after is not None:
+            lo += self.datetimes[lo:hi].searchsorted(
+                np.datetime64(after), 'right')
+        return self.df.iloc[lo:hi]
+
+
+class CGOOBase:
+    '''
+    Connect to CGOO database
+
+    Queries share a pool of concurrency connections
+    and are rate limited by a token bucket. query_rate and query_burst
+    default to the class attributes, a query_rate of None is unlimited.
+    '''
+    query_rate = 1                 # queries per second, None is unlimited
+    query_burst = 1
+
+    def __init__(self, credentials, concurrency=1, query_rate=...,
+                 query_burst=...):
         self.credentials = credentials
+        self.concurrency = concurrency
+        self.bucket = TokenBucket(
+            self.query_rate if query_rate is ... else query_rate,
+            self.query_burst if query_burst is ... else query_burst)
 
-        self._connection = None
-        self._cursor = None
+        self._connections = []
+        self._pool = queue.Queue()
 
     def __repr__(self):
         return f'<{self.__class__.__name__}(connected={self.is_connected})>'
@@ -35,34 +119,94 @@ class CGOOBase:
 
     @property
     def is_connected(self):
-        return bool(self._connection)
+        return bool(self._connections)
+
+    def _connect(self):
+        if pyodbc is None:
+            raise ImportError('pyodbc is required to connect to CGOO')
+        return pyodbc.connect(self.connection_string)
 
     @log(logger, level=logging.INFO)
     def connect(self):
-        self._connection = pyodbc.connect(self.connection_string)
-        self._cursor = self._connection.cursor()
-
-    def query(self, sql_statement, *args):
-        self._cursor.execute(sql_statement, *args)
+        for _ in range(self.concurrency):
+            connection = self._connect()
+            self._connections.append(connection)
+            self._pool.put(connection)
+
+    @contextmanager
+    def cursor(self):
+        '''Cursor of a pooled connection, waits for a free connection'''
+        connection = self._pool.get()
+        try:
+            yield connection.cursor()
+        finally:
+            self._pool.put(connection)
+
+    def query(self, sql_statement, *args) -> tuple[list, list]:
+        self.bucket.acquire()
+        with self.cursor() as cursor:
+            cursor.execute(sql_statement, *args)
+            header = [i[0] for i in cursor.description]
+            rows = cursor.fetchall()
 
         logger.debug(f'cgoo - query - {", ".join(args)}')
+        return header, rows
+
+    def query_batches(self, sql_statement, *args, size=10_000):
+        '''Yield the header and batches of rows, at least one batch'''
+        self.bucket.acquire()
+        with self.cursor() as cursor:
+            cursor.execute(sql_statement, *args)
+            header = [i[0] for i in cursor.description]
+            logger.debug(f'cgoo - query_batches - {", ".join(args)}')
+
+            rows = cursor.fetchmany(size)
+            yield header, rows
+            while rows:
+                rows = cursor.fetchmany(size)
+                if rows:
+                    yield header, rows
+
+    def map(self, f, *iterables) -> list:
+        '''
+        Apply f concurrently, bounded by the connection pool size
+
+        Calls run in copies of the caller's context, so exceptions caught
+        in the threads reach its collector.
+        '''
+        context = contextvars.copy_context()
+
+        def run(*args):
+            return context.copy().run(f, *args)
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            return list(executor.map(run, *iterables))
 
 
 class CGOO(CGOOBase):
     sql_stmt_fmt = 'exec [dbo].SP_sub_Long_Hist ?, ?, ?'
     default_time_window = dt.timedelta(days=31)
-    query_delay_seconds = 1
+    min_time_window = dt.timedelta(days=1)
+    max_time_window = dt.timedelta(days=366)
+    max_window_factor = 4
+    target_window_rows = 50_000
+    fetch_size = 10_000
+    catalog_ttl = dt.timedelta(days=1)
     global_startdatetime = dt.datetime(2023, 6, 1)  # test setting
 
-    def __init__(self, dstpath, write_kw, credentials):
-        super().__init__(credentials)
+    def __init__(self, dstpath, write_kw, credentials, streaming=False,
+                 storepath=None, catalogpath=None, **pool_kw):
+        super().__init__(credentials, **pool_kw)
 
         self.dstpath = Path(dstpath)
         self.write_kw = write_kw
+        self.streaming = streaming
+        self.store = TimeseriesStore(storepath) if storepath else None
+        self.catalog = TagCatalog(catalogpath, self.catalog_ttl)
 
         self._df = pd.DataFrame()
-        self.query_args = ()
-        self.query_response = None
+        self._partition = (None, None)
+        self.window_stats = []
 
     @property
     def df(self):
@@ -80,36 +224,58 @@ class CGOO(CGOOBase):
     def dt2str(datetime, fmt="%Y-%m-%d %H:%M:%S"):
         return dt.datetime.strftime(datetime, fmt)
 
-    def get_tag_df(self, tag, startdatetime=None):
+    def partition(self, df=None) -> Partition:
+        '''Partition of df, kept for the last DataFrame partitioned'''
+        df = self.df if df is None else df
+        partitioned, partition = self._partition
+        if partitioned is not df:
+            partition = Partition(df)
+            self._partition = (df, partition)
+        return partition
+
+    def get_tag_df(self, tag, startdatetime=None, df=None):
         startdatetime = startdatetime or self.global_startdatetime
 
-        return self.df[
-            (self.df.TagName == tag.tag) &
-            (self.df.DateTime > startdatetime + dt.timedelta(seconds=1))]\
-            .sort_values('DateTime')
+        return self.partition(df).select(
+            tag.tag, startdatetime + dt.timedelta(seconds=1))
 
-    def datetimeperiod(self, tag):
-        tag_df = self.get_tag_df(tag)
-        startdatetime = tag_df.iloc[0][0]
-        enddatetime = tag_df.iloc[-1][0]
+    def datetimeperiod(self, tag, df=None):
+        tag_df = self.get_tag_df(tag, df=df)
+        startdatetime = tag_df.iloc[0, 0]
+        enddatetime = tag_df.iloc[-1, 0]
         return startdatetime, enddatetime
 
     def query(self, location, startdatetime, enddatetime):
-        time.sleep(self.query_delay_seconds)
+        query_args = (
+            location,
+            self.dt2str(startdatetime),
+            self.dt2str(enddatetime)
+            )
+        return super().query(self.sql_stmt_fmt, *query_args)
 
-        self.query_args = (
+    def query_batches(self, location, startdatetime, enddatetime):
+        query_args = (
             location,
             self.dt2str(startdatetime),
             self.dt2str(enddatetime)
             )
+        return super().query_batches(
+            self.sql_stmt_fmt, *query_args, size=self.fetch_size)
 
-        super().query(self.sql_stmt_fmt, *self.query_args)
-        self.query_response = self._cursor.fetchall()
-        return self.query_response
+    @staticmethod
+    def to_frame(header, rows) -> pd.DataFrame:
+        '''Typed columns of a batch of rows'''
+        datetimes, tags, values = zip(*rows) if rows else ((), (), ())
+        return pd.DataFrame({
+            header[0]: np.array(datetimes, dtype='datetime64[ns]'),
+            header[1]: pd.Categorical(tags),
+            header[2]: np.array(values, dtype='float64'),
+            })
 
-    def empty_response(self):
+    @staticmethod
+    def empty_response(response):
         tags, values = [], []
-        for _, tag, value in self.query_response:
+        for _, tag, value in response:
             tags.append(tag)
             values.append(value)
 
@@ -118,41 +284,304 @@ class CGOO(CGOOBase):
             return True
         return False
 
-    @functools.lru_cache(maxsize=10)
-    def get_unique_tags(self, location):
+    def query_unique_tags(self, location) -> set:
         future_start = future_end = dt.datetime.now() + dt.timedelta(days=1)
-        response = self.query(location, future_start, future_end)
+        _, response = self.query(location, future_start, future_end)
         return set(i[1] for i in response)
 
-    def get_timeseries(self, location, startdatetime=None, enddatetime=None):
+    def get_unique_tags(self, location) -> set:
+        '''Unique tags of location, misses are saved with the catalog'''
+        tags = self.catalog.get(location)
+        if tags is None:
+            tags = self.query_unique_tags(location)
+            self.catalog.put(location, tags)
+        return tags
+
+    def prefetch_unique_tags(self, locations) -> dict:
+        '''
+        Query the unique tags of locations missing in the catalog
+
+        Returns the exceptions of failing locations, they are left out of
+        the catalog and do not stop the others.
+        '''
+        def query(location):
+            try:
+                return self.query_unique_tags(location), None
+            except Exception as e:
+                return None, e
+
+        missing = self.catalog.missing(locations)
+        errors = {}
+        for location, (tags, e) in zip(missing, self.map(query, missing)):
+            if e is None:
+                self.catalog.put(location, tags)
+            else:
+                errors[location] = e
+                logger.error(f'cgoo - prefetch - {location} - {repr(e)}')
+        self.catalog.save()
+        return errors
+
+    @staticmethod
+    def count_rows(response) -> int:
+        return sum(value is not None for _, _, value in response)
+
+    @staticmethod
+    def first_values(response, first=None) -> dict:
+        '''Earliest timestamp with a value per tag'''
+        first = {} if first is None else first
+        for datetime, tag, value in response:
+            if value is not None:
+                first[tag] = min(first.get(tag, datetime), datetime)
+        return first
+
+    def next_window(self, window, rows):
+        '''Scale the window towards target_window_rows, within bounds'''
+        factor = self.target_window_rows / max(rows, 1)
+        factor = min(max(factor, 1 / self.max_window_factor),
+                     self.max_window_factor)
+        return min(max(window * factor, self.min_time_window),
+                   self.max_time_window)
+
+    def reset_stats(self):
+        self.window_stats = []
+
+    def stats(self) -> pd.DataFrame:
+        '''Windows issued and rows per window, by location'''
+        df = pd.DataFrame(self.window_stats, columns=[
+            'location', 'startdatetime', 'enddatetime', 'rows'])
+        return df.groupby('location').rows.agg(
+            windows='count', rows='sum', rows_per_window='mean')
+
+    def backfill(self, location, fetch, startdatetime=None,
+                 enddatetime=None) -> bool:
+        '''
+        Call fetch backwards in windows until t_start or an empty window
+
+        fetch(t_i, t_end) returns the number of values and whether the
+        window was empty. Windows adapt to the number of values, the
+        start is raised to the earliest known timestamp of the location's
+        tags. Without it, the backfill runs dry at an empty window of at
+        least default_time_window, a shorter one may be a gap and is
+        followed by a window of default_time_window. Returns True if the
+        backfill ran dry.
+        '''
         t_start = startdatetime or self.global_startdatetime
         t_end = enddatetime or dt.datetime.now()
-        t_i = t_end - self.default_time_window
+        window = self.default_time_window
+
+        earliest = self.catalog.earliest(location)
+        if earliest is not None and earliest > t_start:
+            t_start = min(earliest, t_end)
 
         logger.info(f'{location=} from={str(t_start)} to={str(t_end)} ...')
 
-        df_data = []
+        windows = 0
         while True:
-            if t_i < t_start:
-                df_data += self.query(location, t_start, t_end)
+            t_i = max(t_end - window, t_start)
+            rows, empty = fetch(t_i, t_end)
+            self.window_stats.append((location, t_i, t_end, rows))
+            windows += 1
+
+            if t_i <= t_start:
+                exhausted = False
+                break
+            if empty and earliest is None and \
+                    t_end - t_i >= self.default_time_window:
+                exhausted = True
                 break
-            else:
-                df_data += self.query(location, t_i, t_end)
 
+            window = self.next_window(window, rows)
+            if empty:
+                window = max(window, self.default_time_window)
             t_end = t_i
-            t_i = t_i - self.default_time_window
 
-            if self.empty_response():
-                break
+        logger.info(f'{location=} {windows=}')
+        return exhausted
+
+    def get_timeseries(self, location, startdatetime=None, enddatetime=None):
+        if self.store is not None:
+            tags = self.update(location, startdatetime, enddatetime)
+            self._df = self.store.read(
+                tags, startdatetime or self.global_startdatetime)
+            return self._df
+
+        header, df_data = [], []
+
+        def fetch(t_i, t_end):
+            nonlocal header
+            header, response = self.query(location, t_i, t_end)
+            df_data.extend(response)
+            return self.count_rows(response), self.empty_response(response)
+
+        if self.backfill(location, fetch, startdatetime, enddatetime):
+            self.catalog.set_earliest(
+                location, set(tag for _, tag, _ in df_data),
+                self.first_values(df_data))
 
-        header = [i[0] for i in self._cursor.description]
         self._df = pd.DataFrame.from_records(df_data, columns=header)
+        return self._df
 
-    def save(self, tag, startdatetime=None, reldir=''):
+    def update(self, location, startdatetime=None, enddatetime=None) -> set:
+        '''
+        Fetch a location into the store and return its tags
+
+        Only the delta after the high-water mark of the location's tags
+        is queried if the store holds them since startdatetime.
+        '''
+        t_start = startdatetime or self.global_startdatetime
+        t_end = enddatetime or dt.datetime.now()
+        tags = set(self.get_unique_tags(location))
+
+        high = self.store.covered(tags, t_start)
+        if high is not None:
+            if high >= t_end:
+                return tags
+            logger.info(f'{location=} stored until {str(high)}')
+            t_start = high
+
+        first = {}
+
+        def fetch(t_i, t_end):
+            _, response = self.query(location, t_i, t_end)
+            self.store.insert(response)
+            tags.update(tag for _, tag, _ in response)
+            self.first_values(response, first)
+
+            # a delta must reach the high-water mark to leave no gap
+            empty = high is None and self.empty_response(response)
+            return self.count_rows(response), empty
+
+        exhausted = self.backfill(location, fetch, t_start, t_end)
+        if exhausted:
+            self.catalog.set_earliest(location, tags, first)
+        self.store.set_marks(tags, None if exhausted else t_start, t_end)
+        return tags
+
+    def stream_timeseries(self, location, tags, startdatetime=None,
+                          enddatetime=None, reldir=''):
+        '''
+        Query like get_timeseries and save tags like save
+
+        Batches are fetched into typed columns and spilled per tag as they
+        arrive, the tag files are stitched from the spilled windows in
+        chronological order. Memory is bounded by a single batch while
+        fetching and by a single tag and window while stitching.
+        '''
         dstpath = self.dstpath / reldir
-        filepath = dstpath / tag.filename()
-        startdatetime = startdatetime or self.global_startdatetime
+        tags = {tag.tag: tag for tag in tags}
+        cutoff = np.datetime64(
+            self.global_startdatetime + dt.timedelta(seconds=1))
+
+        header, seen, earliest, spilled = [], set(), {}, []
+        dates_only, fractions = {}, {}
+        tag_ids = {}
+
+        def tag_id(tag):
+            return tag_ids.setdefault(tag, len(tag_ids))
+
+        with tempfile.TemporaryDirectory(
+                dir=scratch(self.dstpath), prefix='cgoo-') as tmpdir:
+
+            def fetch(t_i, t_end):
+                nonlocal header
+                window, window_tags, rows, values_count = {}, set(), 0, 0
+                for header, batch in self.query_batches(location, t_i, t_end):
+                    df = self.to_frame(header, batch)
+                    datetimes, tagnames, values = (df[c] for c in header)
+                    rows += len(df)
+                    window_tags.update(tagnames.unique())
+
+                    has_value = values.notna()
+                    values_count += int(has_value.sum())
+                    for tag, first in datetimes[has_value].groupby(
+                            tagnames[has_value], observed=True).min().items():
+                        earliest[tag] = min(earliest.get(tag, first), first)
+
+                    keep = tagnames.isin(tags) & (datetimes > cutoff)
+                    for tag, g in df[keep].groupby(
+                            header[1], observed=True, sort=False):
+                        ns = g[header[0]].to_numpy().view('i8')
+                        dates_only[tag] = dates_only.get(tag, True) and \
+                            not (ns % 86_400_000_000_000).any()
+                        fractions[tag] = fractions.get(tag, False) or \
+                            bool((ns % 1_000_000_000).any())
+
+                        pieces = window.setdefault(tag, [])
+                        pieces.append(Path(
+                            tmpdir, f'{len(spilled)}-{tag_id(tag)}-'
+                            f'{len(pieces)}'))
+                        g.to_pickle(pieces[-1])
+                spilled.append(window)
+                seen.update(window_tags)
+
+                empty = not values_count and rows == len(window_tags)
+                return values_count, empty
+
+            if self.backfill(location, fetch, startdatetime, enddatetime):
+                self.catalog.set_earliest(location, seen, {
+                    tag: t.to_pydatetime() for tag, t in earliest.items()})
+
+            self.stitch(dstpath, tags, spilled, header, dates_only, fractions)
 
-        self.get_tag_df(tag, startdatetime).to_csv(filepath, **self.write_kw)
+    @staticmethod
+    def read_spilled(pieces, by) -> pd.DataFrame:
+        '''Batches spilled of a tag in one window, sorted by DateTime'''
+        df = pd.concat([pd.read_pickle(piece) for piece in pieces])
+        return df.sort_values(by, kind='stable')
+
+    def stitch(self, dstpath, tags, spilled, header, dates_only, fractions):
+        '''Write tag files from windows spilled in reverse order'''
+        write_kw = {k: v for k, v in self.write_kw.items() if k != 'encoding'}
+        encoding = self.write_kw.get('encoding', 'utf-8')
+
+        for tagname, tag in tags.items():
+            # format dates once for the whole tag, like a single to_csv
+            if dates_only.get(tagname):
+                date_format = '%Y-%m-%d'
+            elif fractions.get(tagname):
+                date_format = '%Y-%m-%d %H:%M:%S.%f'
+            else:
+                date_format = '%Y-%m-%d %H:%M:%S'
+
+            filepath = dstpath / tag.filename()
+            fd, tmppath = mkstemp(
+                scratch(self.dstpath), prefix=f'{filepath.name}-')
+            with open(fd, 'w', encoding=encoding, newline='') as f:
+                pd.DataFrame(columns=header).to_csv(f, **write_kw)
+                for window in reversed(spilled):
+                    if tagname in window:
+                        self.read_spilled(window[tagname], header[0]).to_csv(
+                            f, header=False, date_format=date_format,
+                            **write_kw)
+            replace(tmppath, filepath)
+            logger.info(f'{filepath.name}')
+
+    def write(self, tag, tag_df, reldir=''):
+        filepath = self.dstpath / reldir / tag.filename()
+        tag_df.to_csv(filepath, **self.write_kw)
 
         logger.info(f'{filepath.name}')
+
+    def save(self, tag, startdatetime=None, reldir='', df=None):
+        startdatetime = startdatetime or self.global_startdatetime
+
+        if df is None and self.store is not None:
+            tag_df = self.store.read(
+                [tag.tag], startdatetime + dt.timedelta(seconds=1))
+        else:
+            tag_df = self.get_tag_df(tag, startdatetime, df)
+        self.write(tag, tag_df, reldir)
+
+    def save_many(self, tags, startdatetime=None, reldir='', df=None):
+        '''Save tags of one location, partitioning its DataFrame once'''
+        tags = {tag.tag: tag for tag in tags}.values()
+        if df is None and self.store is not None:
+            for tag in tags:
+                self.save(tag, startdatetime, reldir)
+            return
+
+        after = (startdatetime or self.global_startdatetime) \
+            + dt.timedelta(seconds=1)
+        partition = self.partition(df)
+        for tag in tags:
+            self.write(tag, partition.select(tag.tag, after), reldir)
@@ -1,10 +1,19 @@
+import io
+import os
+import json
+import hashlib
 import logging
-from pathlib import Path
+import weakref
 import datetime as dt
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
 
-from fews_spoccer.utils import log, catch
+from fews_spoccer.utils import (log, catch, scratch, mkstemp, replace,
+                                ErrorCollector)
 from ...spoc.etypes import (
     H2GOFileNotFoundException, H2GOMultipleFilesFoundException,
     H2GOFileContentException)
@@ -13,23 +22,158 @@ from ...spoc.etypes import (
 logger = logging.getLogger(__name__)
 
 
+class H2GOCatalog:
+    '''
+    Index of the H2GO files in a directory tree
+
+    Files are keyed on their LOCATIEID_MEETPUNTID prefix. The tree is
+    scanned once, refresh rescans only directories whose mtime changed.
+    '''
+    _catalogs = {}
+
+    def __init__(self, srcpath):
+        self.srcpath = Path(srcpath)
+
+        self.dirs = {}              # dirpath: (mtime_ns, files, subdirs)
+        self.index = {}             # key: [filepath]
+        self.scan(self.srcpath)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.srcpath})'
+
+    @classmethod
+    def get(cls, srcpath) -> 'H2GOCatalog':
+        '''Catalog shared by all H2GO objects of a srcpath'''
+        srcpath = Path(srcpath).resolve()
+        if srcpath not in cls._catalogs:
+            cls._catalogs[srcpath] = cls(srcpath)
+        return cls._catalogs[srcpath]
+
+    @staticmethod
+    def key(filename: str) -> str:
+        return '_'.join(filename.split('_')[:2]).removesuffix('.csv')
+
+    def scan(self, dirpath: Path):
+        '''Index the files of a directory and its new subdirectories'''
+        mtime_ns = dirpath.stat().st_mtime_ns
+        files, subdirs = [], []
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subdirs.append(Path(entry.path))
+                elif entry.name.endswith('.csv'):
+                    files.append(Path(entry.path))
+
+        for subdir in self.drop(dirpath) - set(subdirs):
+            self.forget(subdir)
+        self.dirs[dirpath] = (mtime_ns, files, subdirs)
+        for filepath in files:
+            self.index.setdefault(self.key(filepath.name), []).append(
+                filepath)
+        for subdir in subdirs:
+            if subdir not in self.dirs:
+                self.scan(subdir)
+
+    def drop(self, dirpath: Path) -> set:
+        '''Remove the files of a directory, return its subdirectories'''
+        if dirpath not in self.dirs:
+            return set()
+        _, files, subdirs = self.dirs.pop(dirpath)
+        for filepath in files:
+            key = self.key(filepath.name)
+            self.index[key].remove(filepath)
+            if not self.index[key]:
+                del self.index[key]
+        return set(subdirs)
+
+    def forget(self, dirpath: Path):
+        '''Remove a directory and its subdirectories from the index'''
+        for subdir in self.drop(dirpath):
+            self.forget(subdir)
+
+    @log(logger)
+    def refresh(self):
+        '''Rescan directories that changed since the last scan'''
+        for dirpath in list(self.dirs):
+            if dirpath not in self.dirs:
+                continue
+            try:
+                mtime_ns = dirpath.stat().st_mtime_ns
+            except FileNotFoundError:
+                self.forget(dirpath)
+                continue
+            if mtime_ns != self.dirs[dirpath][0]:
+                self.scan(dirpath)
+
+    def find(self, pattern) -> list:
+        return self.index.get(pattern, [])
+
+    def missing(self, patterns) -> list:
+        return [p for p in dict.fromkeys(patterns) if p not in self.index]
+
+    def duplicates(self, patterns=None) -> dict:
+        keys = self.index if patterns is None else dict.fromkeys(patterns)
+        return {k: self.index[k] for k in keys
+                if len(self.index.get(k, [])) > 1}
+
+
+def pattern_records(h2go, pattern) -> list:
+    '''Error record of a H2GO pattern'''
+    file = None if h2go.filepath is None else h2go.filepath.name
+    return [{'file': file, 'value': pattern}]
+
+
 class H2GO:
-    fmt = '%d-%m-%Y %H:%M:%S'
+    fmt_datum = '%d-%m-%Y'
+    fmt_tijd = '%H:%M:%S'
+    fmt = f'{fmt_datum} {fmt_tijd}'
+    tz_in = 'utc'
+    tz_out = 'Europe/Amsterdam'
+    ambiguous = 'raise'             # see pandas tz_localize, only
+    nonexistent = 'raise'           # applies to tz_in other than utc
+    metadir = '.h2go'               # private dir of dstpath
 
-    def __init__(self, srcpath, dstpath, read_kw, write_kw):
+    def __init__(self, srcpath, dstpath, read_kw, write_kw, chunksize=None,
+                 incremental=False):
         self.srcpath = Path(srcpath)
         self.dstpath = Path(dstpath)
         self.read_kw = read_kw
         self.write_kw = write_kw
+        self.chunksize = chunksize
+        self.incremental = incremental
 
         self.pattern = None
         self.filepath = None
 
         self._df = pd.DataFrame()
+        self.datetimes = pd.Series(dtype='datetime64[ns]')
+        self.period = None
+        self.dtypes = {}
+        self.size = None            # bytes of the source that were read
+        self.last_datum = None
+        self.appending = False
+
+        self.tmppath = None         # chunked conversion awaiting save
+        self._cleanup = None
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.filepath.name})'
 
+    def __getstate__(self):
+        '''Pickling, e.g. from a worker, hands over the tmp file'''
+        state = self.__dict__.copy()
+        if state.pop('_cleanup', None) is not None:
+            self._cleanup.detach()
+            self._cleanup = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cleanup = None
+        if self.tmppath is not None:
+            self._cleanup = weakref.finalize(
+                self, self.tmppath.unlink, missing_ok=True)
+
     @property
     def df(self):
         return self._df
@@ -38,24 +182,62 @@ class H2GO:
     def is_empty(self):
         return self.df.empty
 
-    def concat_dt(self, idx, fmt):
-        return dt.datetime.strptime(
-            ' '.join((
-                self.df.iloc[idx]['DATUM'],
-                self.df.iloc[idx]['TIJD'])), fmt)
-
     @property
     def startdatetime(self):
-        return self.concat_dt(0, self.fmt)
+        if self.period is not None:
+            return self.period[0]
+        if self.datetimes.empty:
+            return self.summary.startdatetime
+        return self.datetimes.iloc[0].to_pydatetime()
 
     @property
     def enddatetime(self):
-        return self.concat_dt(-1, self.fmt)
+        if self.period is not None:
+            return self.period[1]
+        if self.datetimes.empty:
+            return self.summary.enddatetime
+        return self.datetimes.iloc[-1].to_pydatetime()
+
+    @property
+    def summary(self) -> 'H2GOSummary':
+        return H2GOSummary.get(self.filepath, self.read_kw)
+
+    @property
+    def outpath(self):
+        return self.dstpath / self.filepath.name
+
+    @property
+    def metapath(self):
+        return self.dstpath / self.metadir / f'{self.filepath.name}.json'
+
+    @classmethod
+    def parse_datetimes(cls, datum, tijd) -> pd.Series:
+        return pd.to_datetime(datum, format=cls.fmt_datum) + \
+            pd.to_timedelta(tijd)
+
+    @classmethod
+    def format_datetimes(cls, datetimes) -> tuple:
+        '''DATUM and TIJD strings, sliced from ISO strings of datetimes'''
+        if datetimes.isna().any():
+            return (datetimes.dt.strftime(cls.fmt_datum),
+                    datetimes.dt.strftime(cls.fmt_tijd))
+
+        iso = np.datetime_as_string(
+            datetimes.to_numpy('datetime64[s]'), unit='s').astype('S19')
+        chars = iso.view('S1').reshape(-1, 19)
+        datum = chars[:, [8, 9, 4, 5, 6, 7, 0, 1, 2, 3]]   # DD-MM-YYYY
+        tijd = chars[:, 11:19]                              # HH:MM:SS
+        return (
+            np.ascontiguousarray(datum).view('S10').ravel().astype(str),
+            np.ascontiguousarray(tijd).view('S8').ravel().astype(str))
+
+    @property
+    def catalog(self):
+        return H2GOCatalog.get(self.srcpath)
 
     @log(logger)
     def file_exists(self, pattern):
-        filetree = self.srcpath.rglob('*.csv')
-        filepath = [p for p in filetree if p.name.startswith(pattern)]
+        filepath = self.catalog.find(pattern)
 
         if len(filepath) == 1:
             self.pattern = pattern
@@ -70,40 +252,277 @@ class H2GO:
     @log(logger)
     def read(self):
         self._df = pd.read_csv(self.filepath, **self.read_kw)
+        self.datetimes = self.parse_datetimes(self.df.DATUM, self.df.TIJD)
+        self.dtypes = self.df.dtypes.astype(str).to_dict()
+        if len(self.df):
+            self.last_datum = str(self.df.DATUM.iloc[-1])
 
     @log(logger)
-    def check_content(self):
+    def check_content(self, df=None):
+        df = self.df if df is None else df
         locid, mptid = self.pattern.split('_')
-        if not all(self.df.LOCATIEID.astype(str) == locid):
+        if not all(df.LOCATIEID.astype(str) == locid):
             raise H2GOFileContentException(self.filepath, locid)
 
-        if not all(self.df.MEETPUNTID.astype(str) == mptid):
+        if not all(df.MEETPUNTID.astype(str) == mptid):
             raise H2GOFileContentException(self.filepath, mptid)
 
+    @classmethod
+    def localize(cls, datetimes, tz_in=None, tz_out=None) -> pd.Series:
+        return datetimes.dt.tz_localize(
+            tz_in or cls.tz_in, ambiguous=cls.ambiguous,
+            nonexistent=cls.nonexistent)\
+            .dt.tz_convert(tz_out or cls.tz_out).dt.tz_localize(None)
+
     @log(logger)
-    def convert_tz(self, tz_in='utc', tz_out='Europe/Amsterdam'):
-        datum_tijd = self.df.DATUM + ' ' + self.df.TIJD
+    def convert_tz(self, tz_in=None, tz_out=None):
+        '''Convert datetimes, DATUM and TIJD are rendered at write'''
+        self.datetimes = self.localize(self.datetimes, tz_in, tz_out)
+
+    def render(self):
+        self._df['DATUM'], self._df['TIJD'] = self.format_datetimes(
+            self.datetimes)
+
+    def resolve_dtypes(self) -> dict:
+        '''Dtype names of a full read, resolved from those of all chunks'''
+        if not isinstance(self.read_kw.get('dtype', {}), dict):
+            return pd.read_csv(self.filepath, nrows=0, **self.read_kw)\
+                .dtypes.astype(str).to_dict()
 
-        tz_in_naive = pd.to_datetime(datum_tijd, dayfirst=True)
-        tz_in_aware = pd.Index(tz_in_naive).tz_localize(tz_in)
+        found = {}
+        for chunk in pd.read_csv(
+                self.filepath, chunksize=self.chunksize, **self.read_kw):
+            for column, dtype in chunk.dtypes.items():
+                found.setdefault(column, set()).add(dtype)
 
-        tz_out_aware = tz_in_aware.tz_convert(tz_out)
-        tz_out_naive = pd.Series(tz_out_aware.strftime('%d-%m-%Y %H:%M:%S'))
+        dtypes = {}
+        for column, chunk_dtypes in found.items():
+            if len(chunk_dtypes) == 1:
+                dtypes[column] = str(chunk_dtypes.pop())
+            elif all(pd.api.types.is_numeric_dtype(d) and
+                     not pd.api.types.is_bool_dtype(d) for d in chunk_dtypes):
+                dtypes[column] = 'float64'
+            else:
+                dtypes[column] = 'str'
+        return dtypes
 
-        self._df[['DATUM', 'TIJD']] = tz_out_naive.str.split(expand=True)
+    def chunks(self):
+        '''
+        Chunks read with the dtypes of a full read
+
+        Rows of the last DATUM of a chunk are held back for the next,
+        a day and its DST transition are never split over chunks.
+        '''
+        read_kw = dict(self.read_kw)
+        self.dtypes = self.resolve_dtypes()
+        if isinstance(read_kw.get('dtype', {}), dict):
+            read_kw['dtype'] = {**self.dtypes, **read_kw.get('dtype', {})}
+
+        carry = None
+        for chunk in pd.read_csv(
+                self.filepath, chunksize=self.chunksize, **read_kw):
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            if chunk.empty:
+                continue
+            other_day = chunk.DATUM.to_numpy()[::-1] != chunk.DATUM.iloc[-1]
+            n = len(chunk) - other_day.argmax() if other_day.any() else 0
+            if n:
+                yield chunk.iloc[:n]
+            carry = chunk.iloc[n:]
+        if carry is not None and len(carry):
+            yield carry
+
+    def discard(self):
+        '''Remove a converted tmp file that will not be saved'''
+        if self._cleanup is not None:
+            self._cleanup()
+        self.tmppath, self._cleanup = None, None
+
+    @log(logger)
+    def convert(self):
+        '''
+        Read, check, convert and write in chunks to tmppath
+
+        The tmp file lives in the scratch dir of dstpath, it is moved in
+        place on save and removed when the object is discarded unsaved.
+        '''
+        write_kw = {k: v for k, v in self.write_kw.items() if k != 'encoding'}
+        encoding = self.write_kw.get('encoding', 'utf-8')
+
+        self.discard()
+        fd, self.tmppath = mkstemp(
+            scratch(self.dstpath), prefix=f'{self.filepath.name}-')
+        self._cleanup = weakref.finalize(
+            self, self.tmppath.unlink, missing_ok=True)
+
+        self.period, header = None, True
+        try:
+            with os.fdopen(fd, 'w', encoding=encoding, newline='') as f:
+                for chunk in self.chunks():
+                    self.check_content(chunk)
+                    datetimes = self.localize(
+                        self.parse_datetimes(chunk.DATUM, chunk.TIJD))
+
+                    self.last_datum = str(chunk.DATUM.iloc[-1])
+                    chunk = chunk.copy()
+                    chunk['DATUM'], chunk['TIJD'] = self.format_datetimes(
+                        datetimes)
+                    chunk.to_csv(f, header=header, **write_kw)
+
+                    header = False
+                    self.period = (
+                        self.period[0] if self.period else
+                        datetimes.iloc[0].to_pydatetime(),
+                        datetimes.iloc[-1].to_pydatetime())
+
+                if header:
+                    pd.read_csv(self.filepath, nrows=0, **self.read_kw)\
+                        .to_csv(f, **write_kw)
+        except BaseException:
+            self.discard()
+            raise
+
+    def fingerprint(self, size) -> str:
+        '''sha256 of the first size bytes of the source'''
+        sha = hashlib.sha256()
+        with open(self.filepath, 'rb') as f:
+            while size > 0:
+                block = f.read(min(size, 2**20))
+                if not block:
+                    break
+                sha.update(block)
+                size -= len(block)
+        return sha.hexdigest()
+
+    def read_meta(self) -> dict | None:
+        try:
+            return json.loads(self.metapath.read_text())
+        except (OSError, ValueError):
+            return None
+
+    @log(logger)
+    def write_meta(self):
+        '''Record the converted source, None if it cannot be appended to'''
+        with open(self.filepath, 'rb') as f:
+            f.seek(max(self.size - 1, 0))
+            complete = f.read(1) == b'\n'
+        if not complete or (self.period is None and self.datetimes.empty):
+            self.metapath.unlink(missing_ok=True)
+            return
+
+        self.metapath.parent.mkdir(exist_ok=True)
+        self.metapath.write_text(json.dumps({
+            'size': self.size,
+            'sha256': self.fingerprint(self.size),
+            'output': self.outpath.stat().st_size,
+            'dtypes': self.dtypes,
+            'period': [self.startdatetime.isoformat(),
+                       self.enddatetime.isoformat()],
+            'datum': self.last_datum,
+            }))
+
+    @log(logger)
+    def check_append(self) -> dict | None:
+        '''Metadata of the output if its source was only appended to'''
+        meta = self.read_meta()
+        if meta is None or not self.outpath.exists():
+            return None
+        if self.outpath.stat().st_size != meta['output'] or \
+                self.size < meta['size']:
+            return None
+        if self.fingerprint(meta['size']) != meta['sha256']:
+            return None
+        return meta
+
+    @log(logger)
+    def read_appended(self) -> bool:
+        '''
+        Read and convert only the rows appended since the last save
+
+        False if the output has to be rebuilt: the source was rewritten,
+        new rows do not parse as the written dtypes, are not newer than
+        the written ones or continue a day whose DST has to be inferred.
+        '''
+        meta = self.check_append()
+        if meta is None:
+            return False
+
+        with open(self.filepath, 'rb') as f:
+            header = f.readline()
+            f.seek(meta['size'])
+            tail = f.read(self.size - meta['size'])
+
+        read_kw = dict(self.read_kw)
+        if isinstance(read_kw.get('dtype', {}), dict):
+            read_kw['dtype'] = {**meta['dtypes'], **read_kw.get('dtype', {})}
+        try:
+            df = pd.read_csv(io.BytesIO(header + tail), **read_kw)
+        except ValueError:
+            return False
+
+        if self.ambiguous == 'infer' and len(df) and \
+                str(df.DATUM.iloc[0]) == meta['datum']:
+            return False
+
+        startdatetime, enddatetime = map(
+            dt.datetime.fromisoformat, meta['period'])
+        datetimes = self.localize(self.parse_datetimes(df.DATUM, df.TIJD))
+        if len(df):
+            if datetimes.iloc[0] <= enddatetime:
+                return False
+            self.check_content(df)
+            enddatetime = datetimes.iloc[-1].to_pydatetime()
+
+        self._df, self.datetimes = df, datetimes
+        self.dtypes = meta['dtypes']
+        self.period = (startdatetime, enddatetime)
+        self.last_datum = str(df.DATUM.iloc[-1]) if len(df) else \
+            meta['datum']
+        self.appending = True
+        return True
 
     @log(logger)
     def write(self):
-        self.df.to_csv(self.dstpath / self.filepath.name, **self.write_kw)
+        if self.appending:
+            self.render()
+            self.df.to_csv(
+                self.outpath, mode='a', header=False, **self.write_kw)
+        elif self.chunksize:
+            if self.tmppath is not None:
+                replace(self.tmppath, self.outpath)
+                self._cleanup.detach()
+                self.tmppath, self._cleanup = None, None
+        else:
+            self.render()
+            self.df.to_csv(self.outpath, **self.write_kw)
+
+        if self.incremental:
+            self.write_meta()
 
-    @catch(logger)
+    @catch(logger, records=pattern_records)
     @log(logger, level=logging.INFO)
     def validate(self, pattern):
         self.file_exists(pattern)
+        self.size = self.filepath.stat().st_size
+        if self.incremental and self.read_appended():
+            return
+
+        if self.chunksize:
+            self.convert()
+            return
+
         self.read()
         self.check_content()
         self.convert_tz()
 
+    @catch(logger, records=pattern_records)
+    @log(logger)
+    def locate(self, pattern):
+        '''Find the single file of pattern, without reading it'''
+        self.file_exists(pattern)
+        self.size = self.filepath.stat().st_size
+
     @classmethod
     def load(cls, pattern, config):
         obj = cls(**config)
@@ -113,3 +532,186 @@ class H2GO:
     @log(logger, level=logging.INFO)
     def save(self):
         self.write()
+
+
+class H2GOSummary:
+    '''
+    Columns and converted first and last datetimes of an H2GO file
+
+    Only the header and the rows of the first and last day are read, the
+    last day by seeking back from the end of the file. Days are converted
+    whole, as ambiguous='infer' needs. Summaries are cached per file and
+    reread when its mtime or size changes.
+    '''
+    blocksize = 2**16
+    _summaries = {}                 # filepath: ((mtime_ns, size), summary)
+
+    def __init__(self, filepath, read_kw):
+        self.filepath = Path(filepath)
+        self.read_kw = read_kw
+
+        self.columns = []
+        self.startdatetime = None
+        self.enddatetime = None
+        self.read()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.filepath.name})'
+
+    @classmethod
+    def get(cls, filepath, read_kw) -> 'H2GOSummary':
+        stat = Path(filepath).stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = cls._summaries.get(filepath)
+        if cached is None or cached[0] != key:
+            cached = cls._summaries[filepath] = (key, cls(filepath, read_kw))
+        return cached[1]
+
+    def parse(self, data: bytes) -> pd.DataFrame:
+        return pd.read_csv(io.BytesIO(data), **self.read_kw)
+
+    def head(self, f, header: bytes) -> pd.DataFrame:
+        '''Rows of the first day'''
+        size = self.blocksize
+        while True:
+            f.seek(len(header))
+            block = f.read(size)
+            complete = len(block) < size
+            if not complete:
+                block = block[:block.rfind(b'\n') + 1]
+
+            df = self.parse(header + block)
+            if df.empty and not complete:
+                size *= 2
+                continue
+            if complete or (df.DATUM != df.DATUM.iloc[0]).any():
+                return df[df.DATUM == df.DATUM.iloc[0]] if len(df) else df
+            size *= 2
+
+    def tail(self, f, header: bytes) -> pd.DataFrame:
+        '''Rows of the last day'''
+        end = f.seek(0, os.SEEK_END)
+        size = self.blocksize
+        while True:
+            start = max(end - size, len(header))
+            f.seek(start)
+            block = f.read(end - start)
+            complete = start == len(header)
+            if not complete:
+                newline = block.find(b'\n')
+                block = block[newline + 1:] if newline >= 0 else b''
+
+            df = self.parse(header + block)
+            if df.empty and not complete:
+                size *= 2
+                continue
+            if complete or (df.DATUM != df.DATUM.iloc[-1]).any():
+                return df[df.DATUM == df.DATUM.iloc[-1]] if len(df) else df
+            size *= 2
+
+    @log(logger)
+    def read(self):
+        with open(self.filepath, 'rb') as f:
+            header = f.readline()
+            head = self.head(f, header)
+            tail = self.tail(f, header)
+
+        self.columns = list(head.columns)
+        if head.empty:
+            return
+        self.startdatetime = H2GO.localize(
+            H2GO.parse_datetimes(head.DATUM, head.TIJD)
+            ).iloc[0].to_pydatetime()
+        self.enddatetime = H2GO.localize(
+            H2GO.parse_datetimes(tail.DATUM, tail.TIJD)
+            ).iloc[-1].to_pydatetime()
+
+
+class _Records(logging.Handler):
+    '''Collect log records of a worker for the parent to handle'''
+    records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _init_worker():
+    logging.getLogger('fews_spoccer').addHandler(_Records())
+
+
+def _process(pattern, config, save, raise_errors=None):
+    '''
+    H2GO pipeline in a worker, returns exceptions and log records
+
+    With the policy of a collector in the parent, caught exceptions are
+    returned as collector counts.
+    '''
+    _Records.records.clear()
+    errors = None if raise_errors is None else ErrorCollector(raise_errors)
+    ErrorCollector.active.set(errors)
+    obj, error = H2GO(**config), None
+    try:
+        obj.validate(pattern)
+        if save:
+            obj.save()
+    except Exception as e:
+        error = e
+    counts = {} if errors is None else errors.counts()
+    return pattern, obj, error, list(_Records.records), counts
+
+
+class H2GOBatch:
+    '''
+    H2GO pipeline for many patterns in a pool of worker processes
+
+    Workers raise or catch like H2GO.load, their log records are handled
+    by the loggers of the parent and the exceptions they caught by its
+    collector. A single worker runs in process.
+    '''
+    def __init__(self, config, workers=1):
+        self.config = config
+        self.workers = workers
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(workers={self.workers})'
+
+    def process(self, patterns, save=False):
+        if self.workers == 1:
+            for pattern in patterns:
+                try:
+                    obj = H2GO.load(pattern, self.config)
+                    if save:
+                        obj.save()
+                except Exception as e:
+                    yield pattern, None, e
+                else:
+                    yield pattern, obj, None
+            return
+
+        errors = ErrorCollector.active.get()
+        raise_errors = None if errors is None else errors.raise_errors
+        with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker) as executor:
+            futures = [executor.submit(
+                _process, p, self.config, save, raise_errors)
+                for p in patterns]
+            for future in futures:
+                pattern, obj, e, records, counts = future.result()
+                for record in records:
+                    logging.getLogger(record.name).handle(record)
+                if counts:
+                    errors.merge(counts)
+                yield pattern, None if e else obj, e
+
+    @log(logger, level=logging.INFO)
+    def run(self, patterns, save=False) -> tuple[dict, dict]:
+        '''H2GO objects and exceptions by pattern'''
+        objects, errors = {}, {}
+        for pattern, obj, e in self.process(dict.fromkeys(patterns), save):
+            if e is None:
+                objects[pattern] = obj
+            else:
+                errors[pattern] = e
+        return objects, errors
@@ -0,0 +1,153 @@
+import sqlite3
+import logging
+import itertools as it
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+
+from .cgoo import CGOO
+from .opvlwater import OpvlWaterModule
+from ...utils import log
+
+
+logger = logging.getLogger(__name__)
+
+
+EPOCH = dt.datetime(1970, 1, 1)
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS tags (
+        location TEXT NOT NULL,
+        TagName TEXT NOT NULL,
+        PRIMARY KEY (location, TagName)
+    );
+    CREATE TABLE IF NOT EXISTS history (
+        TagName TEXT NOT NULL,
+        DateTime INTEGER NOT NULL,
+        Value REAL,
+        PRIMARY KEY (TagName, DateTime)
+    ) WITHOUT ROWID;
+    '''
+
+
+def to_us(datetime) -> int:
+    return (datetime - EPOCH) // dt.timedelta(microseconds=1)
+
+
+class OfflineCursor:
+    '''
+    Cursor emulating SP_sub_Long_Hist on a local history database
+
+    Returns (DateTime, TagName, Value) rows of all tags of a location
+    within [start, end], a tag without rows returns (end, TagName, None).
+    '''
+    description = tuple(
+        (name, type_code, None, None, None, None, None)
+        for name, type_code in (
+            ('DateTime', dt.datetime), ('TagName', str), ('Value', float)))
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = iter(())
+
+    def execute(self, sql_statement, location, startdatetime, enddatetime):
+        start = dt.datetime.strptime(startdatetime, '%Y-%m-%d %H:%M:%S')
+        end = dt.datetime.strptime(enddatetime, '%Y-%m-%d %H:%M:%S')
+        tags = [tag for tag, in self.connection.execute(
+            'SELECT TagName FROM tags WHERE location = ? ORDER BY TagName',
+            (location,))]
+        self._rows = it.chain.from_iterable(
+            self.history(tag, start, end) for tag in tags)
+        return self
+
+    def history(self, tag, start, end):
+        rows = self.connection.execute(
+            'SELECT DateTime, Value FROM history WHERE TagName = ? '
+            'AND DateTime BETWEEN ? AND ? ORDER BY DateTime',
+            (tag, to_us(start), to_us(end)))
+
+        empty = True
+        for us, value in rows:
+            empty = False
+            yield EPOCH + dt.timedelta(microseconds=us), tag, value
+        if empty:
+            yield end, tag, None
+
+    def fetchmany(self, size=1):
+        return list(it.islice(self._rows, size))
+
+    def fetchall(self):
+        return list(self._rows)
+
+
+class OfflineConnection:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    def execute(self, *args):
+        return self._connection.execute(*args)
+
+    def cursor(self):
+        return OfflineCursor(self)
+
+    def close(self):
+        self._connection.close()
+
+
+class OfflineCGOO(CGOO):
+    '''CGOO on a local history database, credentials['database'] is its path'''
+    query_rate = None
+
+    def _connect(self):
+        return OfflineConnection(self.credentials['database'])
+
+
+class OfflineOpvlWaterModule(OpvlWaterModule):
+    cgoo_class = OfflineCGOO
+
+
+@log(logger, level=logging.INFO)
+def generate_history(path, tags: dict, startdatetime, enddatetime,
+                     step=dt.timedelta(minutes=15), gaps=0.0,
+                     gap_length=dt.timedelta(days=7), seed=0) -> int:
+    '''
+    Write a synthetic history of tags {location: [TagName]} to path
+
+    Each tag is a random walk sampled every step. A fraction gaps of the
+    period is left out in gaps of gap_length. Returns the number of rows.
+    '''
+    rng = np.random.default_rng(seed)
+    start, end = to_us(startdatetime), to_us(enddatetime)
+    step_us = step // dt.timedelta(microseconds=1)
+    gap_us = gap_length // dt.timedelta(microseconds=1)
+    n_gaps = int(gaps * (end - start) / gap_us)
+
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+    total = 0
+    with connection:
+        for location, tagnames in tags.items():
+            connection.executemany(
+                'INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                ((location, tag) for tag in tagnames))
+
+            for tag in tagnames:
+                datetimes = np.arange(start, end, step_us)
+                keep = np.ones(len(datetimes), dtype=bool)
+                for gap_start in rng.integers(start, end, n_gaps):
+                    keep &= (datetimes < gap_start) | \
+                        (datetimes >= gap_start + gap_us)
+                values = rng.normal(size=len(datetimes)).cumsum()
+
+                connection.executemany(
+                    'INSERT OR REPLACE INTO history VALUES (?, ?, ?)',
+                    zip(it.repeat(tag), datetimes[keep].tolist(),
+                        values[keep].tolist()))
+                total += int(keep.sum())
+    connection.close()
+    return total
@@ -1,27 +1,130 @@
+import logging
 import itertools as it
 
-from .h2go import H2GO
+from ...spoc.indexer import Matches
+from .h2go import H2GO, H2GOBatch, H2GOCatalog, H2GOSummary
 from .cgoo import CGOO
 
 
+logger = logging.getLogger(__name__)
+
+
 class OpvlWaterModule:
     sync_level = 'LIVE'
+    cgoo_class = CGOO
 
-    def __init__(self, h2go_config, cgoo_config):
+    def __init__(self, h2go_config, cgoo_config, h2go_workers=1):
         self.h2go_config = h2go_config
         self.cgoo_config = cgoo_config
+        self.h2go_batch = H2GOBatch(h2go_config, h2go_workers)
+        self._h2go = {}
+        self._h2go_ends = {}
+        self._h2go_writes = None    # patterns to convert, None for all
 
-        self.cgoo = CGOO(**cgoo_config)
+        self.cgoo = self.cgoo_class(**cgoo_config)
         self.cgoo.connect()
 
     def pre(self, indexer):
         return indexer.spoccer.hl.get_param_matches(indexer)
 
+    @property
+    def h2go_catalog(self):
+        return H2GOCatalog.get(self.h2go_config['srcpath'])
+
+    @staticmethod
+    def matches(indexers) -> Matches:
+        '''Param matches of the sublocations of a non-empty batch'''
+        ids = [i.id for indexer in indexers for i in indexer.sublocations()]
+        return indexers[0].spoccer.hl.param_matches().select_ids(*ids)
+
+    def h2go_patterns(self, indexers) -> list:
+        matches = self.matches(indexers)
+        return matches.df.file[matches.exists('file')].tolist()
+
+    def report_h2go(self, indexers) -> tuple[list, dict]:
+        '''Log missing and duplicate H2GO files of a batch at once'''
+        self.h2go_catalog.refresh()
+        patterns = self.h2go_patterns(indexers)
+
+        missing = self.h2go_catalog.missing(patterns)
+        duplicates = self.h2go_catalog.duplicates(patterns)
+        if missing:
+            logger.warning(f'h2go - missing - {", ".join(missing)}')
+        if duplicates:
+            logger.warning(f'h2go - duplicates - {", ".join(duplicates)}')
+        return missing, duplicates
+
+    def plan_h2go(self, indexers) -> dict:
+        '''
+        End datetime per H2GO pattern of a batch, before conversion
+
+        Read from the file summaries, patterns without a single readable
+        file are left to the conversion to report.
+        '''
+        ends = {}
+        for pattern in dict.fromkeys(self.h2go_patterns(indexers)):
+            filepaths = self.h2go_catalog.find(pattern)
+            if len(filepaths) != 1:
+                continue
+            try:
+                summary = H2GOSummary.get(
+                    filepaths[0], self.h2go_config['read_kw'])
+            except Exception as e:
+                logger.debug(f'h2go - plan - {pattern} - {repr(e)}')
+                continue
+            if summary.enddatetime is not None:
+                ends[pattern] = summary.enddatetime
+        return ends
+
+    def plan_writes(self, indexers) -> set:
+        '''
+        H2GO patterns of a batch that will be written
+
+        Files without a tag are saved, and so are the matched files of a
+        location without unmatched tags. Only these are converted.
+        '''
+        fields = [(indexer, i, f) for indexer in indexers
+                  for i, f in indexer.fields()]
+        writes = {f[i.spocfiles[1]] for _, i, f in fields
+                  if f.exists(i.spocfiles[1]) and not f.exists(i.spocfiles[0])}
+        for _, group in self.group_tags(fields):
+            if all(f.exists(i.spocfiles[1]) for _, i, f in group):
+                writes.update(f[i.spocfiles[1]] for _, i, f in group)
+        return writes
+
+    def converts(self, pattern) -> bool:
+        return self._h2go_writes is None or pattern in self._h2go_writes
+
+    def load_h2go(self, indexers):
+        '''Load the H2GO files of a batch that will be written at once'''
+        objects, errors = self.h2go_batch.run(
+            [p for p in self.h2go_patterns(indexers) if self.converts(p)])
+        self._h2go = {**objects, **errors}
+
+    def h2go_end(self, h2go):
+        '''End of a H2GO file as planned, else of its conversion'''
+        if h2go.pattern in self._h2go_ends:
+            return self._h2go_ends[h2go.pattern]
+        return h2go.enddatetime
+
+    def get_h2go(self, pattern):
+        h2go = self._h2go.get(pattern)
+        if h2go is None:
+            return H2GO.load(pattern, self.h2go_config)
+        if isinstance(h2go, Exception):
+            raise h2go
+        return h2go
+
     def validate_h2go(self, indexer):
+        '''Convert the H2GO files that will be written, locate the others'''
+        self.h2go_catalog.refresh()
         for i, f in indexer.fields():
             if f.exists(i.spocfiles[1]):
                 h2go_field = i.spocfiles[1]
-                f[h2go_field] = H2GO.load(f[h2go_field], self.h2go_config)
+                if self.converts(f[h2go_field]):
+                    f[h2go_field] = self.get_h2go(f[h2go_field])
+                else:
+                    H2GO(**self.h2go_config).locate(f[h2go_field])
 
     def validate_tags(self, indexer):
         for i, f in indexer.fields():
@@ -33,40 +136,140 @@ class OpvlWaterModule:
         self.validate_h2go(indexer)
         self.validate_tags(indexer)
 
-    def run(self, indexer):
-        self.validate(indexer)
-
-        # unmatches h2go objects
+    def save_h2go(self, indexer):
+        '''Save unmatched h2go objects'''
         for i, f in indexer.fields():
             if f.exists(i.spocfiles[1]) and not f.exists(i.spocfiles[0]):
                 h2go_obj = f[i.spocfiles[1]]
                 h2go_obj.save()
 
-        # matches and unmatches tags
-        has_tag = [(i, f) for i, f in indexer.fields()
+    @staticmethod
+    def group_tags(fields):
+        '''Group fields with a tag by location for efficient db query'''
+        has_tag = [(x, i, f) for x, i, f in fields
                    if f.exists(i.spocfiles[0])]
 
         def groupkey(x):
-            '''group tags by location for efficient db query'''
-            return x[1][x[0].spocfiles[0]].location
+            return x[2][x[1].spocfiles[0]].location
 
         has_tag.sort(key=groupkey)
         for location, group in it.groupby(has_tag, key=groupkey):
-            g = list(group)
+            yield location, list(group)
+
+    def sync_tags(self, location, tags, startdatetime=None):
+        if self.cgoo.store is not None:
+            self.cgoo.update(location, startdatetime=startdatetime)
+            self.cgoo.save_many(tags)
+        elif self.cgoo.streaming:
+            self.cgoo.stream_timeseries(
+                location, tags, startdatetime=startdatetime)
+        else:
+            df = self.cgoo.get_timeseries(
+                location, startdatetime=startdatetime)
+            self.cgoo.save_many(tags, df=df)
+
+    def sync_location(self, location, g):
+        tags = [f[i.spocfiles[0]] for i, f in g]
+
+        # unmatched tags
+        if any(f.exists(i.spocfiles[0]) and not f.exists(i.spocfiles[1])
+               for i, f in g):
+
+            self.sync_tags(location, tags)
+
+        # matched tags, converted now if planned as unmatched
+        else:
+            for i, f in g:
+                if isinstance(f[i.spocfiles[1]], str):
+                    f[i.spocfiles[1]] = self.get_h2go(f[i.spocfiles[1]])
+            enddatetime = min(self.h2go_end(f[i.spocfiles[1]]) for i, f in g)
+
+            for i, f in g:
+                f[i.spocfiles[1]].save()
+            self.sync_tags(location, tags, startdatetime=enddatetime)
+
+    def run(self, indexer):
+        errors = self.run_many([indexer])
+        if errors:
+            raise errors[indexer]
+
+    def prefetch_tags(self, indexers) -> dict:
+        '''
+        Query the unique tags of all locations in the batch at once
+
+        Returns the exception of every indexer with a tag at a location
+        that failed.
+        '''
+        matches = self.matches(indexers)
+        failed = self.cgoo.prefetch_unique_tags(
+            matches.df.location[matches.exists('location')])
+
+        errors = {}
+        for indexer in indexers:
+            ids = [i.id for i in indexer.sublocations()]
+            for location in matches.select_ids(*ids).df.location:
+                if location in failed:
+                    errors[indexer] = failed[location]
+                    break
+        return errors
+
+    @staticmethod
+    def run_stage(stage, indexers, default=None):
+        '''
+        Run an optional batch-wide stage
+
+        On failure the default is returned, indexers then load and
+        report their H2GO files on their own and fail one by one.
+        '''
+        try:
+            return stage(indexers)
+        except Exception as e:
+            logger.warning(f'opvlwater - {stage.__name__} - {repr(e)}')
+            return default
+
+    def run_many(self, indexers) -> dict:
+        '''
+        Run a batch of indexers, querying each location once
 
-            # unmatched tags
-            if any(f.exists(i.spocfiles[0]) and not f.exists(i.spocfiles[1])
-                   for i, f in g):
+        Locations are queried concurrently over the CGOO connection pool.
+        Returns the exceptions of failing indexers, a failing
+        location fails all indexers with a tag at that location.
+        '''
+        fields = []
+        if not indexers:
+            return {}
 
-                self.cgoo.get_timeseries(location)
-                for i, f in g:
-                    self.cgoo.save(f[i.spocfiles[0]])
+        self.cgoo.reset_stats()
+        try:
+            errors = self.prefetch_tags(indexers)
+        except Exception as e:
+            return dict.fromkeys(indexers, e)
+        self.run_stage(self.report_h2go, indexers)
+        self._h2go_ends = self.run_stage(self.plan_h2go, indexers, {})
+        self._h2go_writes = self.run_stage(self.plan_writes, indexers)
+        self.run_stage(self.load_h2go, indexers)
+        for indexer in indexers:
+            if indexer in errors:
+                continue
+            try:
+                self.validate(indexer)
+                self.save_h2go(indexer)
+            except Exception as e:
+                errors[indexer] = e
+                continue
+            fields.extend((indexer, i, f) for i, f in indexer.fields())
+        self._h2go = {}
 
-            # matched tags
-            else:
-                enddatetime = min(f[i.spocfiles[1]].enddatetime for i, f in g)
-                self.cgoo.get_timeseries(location, startdatetime=enddatetime)
+        def sync(item):
+            location, group = item
+            try:
+                self.sync_location(location, [(i, f) for _, i, f in group])
+            except Exception as e:
+                return [(x, e) for x, _, _ in group]
+            return []
 
-                for i, f in g:
-                    f[i.spocfiles[1]].save()
-                    self.cgoo.save(f[i.spocfiles[0]])
+        for failed in self.cgoo.map(sync, self.group_tags(fields)):
+            errors.update(failed)
+        self._h2go_ends, self._h2go_writes = {}, None
+        self.cgoo.catalog.save()
+        return errors
@@ -0,0 +1,123 @@
+import sqlite3
+import logging
+import datetime as dt
+from pathlib import Path
+from contextlib import contextmanager
+
+import pandas as pd
+
+from ...utils import log
+
+
+logger = logging.getLogger(__name__)
+
+
+class TimeseriesStore:
+    '''
+    Local store of CGOO timeseries
+
+    Values are keyed on (TagName, DateTime) as microseconds since epoch.
+    A mark per tag holds the period [low, high] that was fetched
+    completely, a low of None is unbounded.
+    '''
+    epoch = dt.datetime(1970, 1, 1)
+    columns = ['DateTime', 'TagName', 'Value']
+    schema = '''
+        CREATE TABLE IF NOT EXISTS timeseries (
+            TagName TEXT NOT NULL,
+            DateTime INTEGER NOT NULL,
+            Value REAL,
+            PRIMARY KEY (TagName, DateTime)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS marks (
+            TagName TEXT PRIMARY KEY,
+            low INTEGER,
+            high INTEGER NOT NULL
+        );
+        '''
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        with self.connect() as con:
+            con.execute('PRAGMA journal_mode=WAL')
+            con.executescript(self.schema)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    @contextmanager
+    def connect(self):
+        '''Connection per call, safe to use from pool threads'''
+        con = sqlite3.connect(self.path, timeout=60)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    @classmethod
+    def to_us(cls, datetime) -> int:
+        return (datetime - cls.epoch) // dt.timedelta(microseconds=1)
+
+    @classmethod
+    def from_us(cls, us):
+        return None if us is None else cls.epoch + dt.timedelta(
+            microseconds=us)
+
+    def insert(self, rows):
+        '''Insert rows of (DateTime, TagName, Value), nulls are kept'''
+        with self.connect() as con:
+            con.executemany(
+                'INSERT OR REPLACE INTO timeseries VALUES (?, ?, ?)',
+                ((tag, self.to_us(datetime), value)
+                 for datetime, tag, value in rows))
+
+    def marks(self, tags) -> dict:
+        tags = list(tags)
+        with self.connect() as con:
+            rows = con.execute(
+                'SELECT TagName, low, high FROM marks WHERE TagName IN '
+                f'({", ".join("?" * len(tags))})', tags).fetchall()
+        return {tag: (self.from_us(low), self.from_us(high))
+                for tag, low, high in rows}
+
+    def covered(self, tags, startdatetime):
+        '''High-water mark of tags if all were fetched since startdatetime'''
+        marks = self.marks(tags)
+        if not tags or len(marks) < len(tags):
+            return None
+        if any(low is not None and low > startdatetime
+               for low, _ in marks.values()):
+            return None
+        return min(high for _, high in marks.values())
+
+    @log(logger)
+    def set_marks(self, tags, low, high):
+        '''Extend marks with a fetched period adjoining the marked one'''
+        low = None if low is None else self.to_us(low)
+        high = self.to_us(high)
+        with self.connect() as con:
+            con.executemany(
+                '''INSERT INTO marks VALUES (?, ?, ?)
+                ON CONFLICT (TagName) DO UPDATE SET
+                    low = CASE WHEN excluded.low IS NULL OR low IS NULL
+                          THEN NULL ELSE min(low, excluded.low) END,
+                    high = max(high, excluded.high)''',
+                ((tag, low, high) for tag in tags))
+
+    def read(self, tags, startdatetime=None) -> pd.DataFrame:
+        '''Values of tags after startdatetime, sorted by DateTime'''
+        tags = list(tags)
+        after = -2**63 if startdatetime is None else self.to_us(
+            startdatetime)
+        with self.connect() as con:
+            df = pd.read_sql_query(
+                'SELECT DateTime, TagName, Value FROM timeseries '
+                f'WHERE TagName IN ({", ".join("?" * len(tags))}) '
+                'AND DateTime > ? ORDER BY DateTime',
+                con, params=[*tags, after])
+
+        df['DateTime'] = pd.to_datetime(df.DateTime, unit='us')
+        return df[self.columns]
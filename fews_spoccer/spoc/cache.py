@@ -0,0 +1,79 @@
+import os
+import json
+import pickle
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+
+from ..utils import log
+
+
+logger = logging.getLogger(__name__)
+
+
+class SpocCache:
+    '''
+    On-disk cache of loaded SpocFiles
+
+    Entries hold the indexed and converted DataFrame and are keyed
+    on size, mtime and content hash of the source file, and on the
+    read arguments. A marker file records a successful validation.
+    '''
+    def __init__(self, path, read_kw=None):
+        self.path = Path(path)
+        self.read_kw = read_kw or {}
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path})'
+
+    def key(self, filepath: Path) -> list:
+        stat = filepath.stat()
+        return [
+            stat.st_size,
+            stat.st_mtime_ns,
+            hashlib.sha256(filepath.read_bytes()).hexdigest(),
+            hashlib.sha256(repr(sorted(
+                self.read_kw.items(), key=str)).encode()).hexdigest(),
+        ]
+
+    def entry(self, spocfile) -> Path:
+        return self.path / f'{spocfile}.pkl'
+
+    def marker(self, spocfile) -> Path:
+        return self.path / f'{spocfile}.json'
+
+    def _dump(self, filepath: Path, data: bytes):
+        '''Write through a temporary file to keep entries consistent'''
+        self.path.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, filepath)
+
+    def get(self, spocfile, key: list) -> tuple | None:
+        '''Cached DataFrame and validation state if the key is unchanged'''
+        try:
+            with open(self.entry(spocfile), 'rb') as f:
+                entry_key, df = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+
+        if entry_key != key:
+            logger.debug(f'cache - get - {spocfile} - stale')
+            return None
+
+        try:
+            validated = json.loads(self.marker(spocfile).read_text()) == key
+        except (OSError, ValueError):
+            validated = False
+        return df, validated
+
+    @log(logger)
+    def put(self, spocfile, key: list):
+        self._dump(self.entry(spocfile), pickle.dumps((key, spocfile.df)))
+        self.marker(spocfile).unlink(missing_ok=True)
+
+    @log(logger)
+    def set_validated(self, spocfile, key: list):
+        self._dump(self.marker(spocfile), json.dumps(key).encode())
@@ -4,7 +4,8 @@ import pandas as pd
 
 from .indexer import Index
 from ..utils import catch, log
-from .etypes import NonUniqueException, EmptyFieldException
+from .etypes import (NonUniqueException, EmptyFieldException,
+                     InvalidPatternException, InvalidTagPatternException)
 from .dtypes import (ColumnField, IndexField, HLField, SLField, OWField,
                      FileParamField, Tag)
 
@@ -12,6 +13,30 @@ from .dtypes import (ColumnField, IndexField, HLField, SLField, OWField,
 logger = logging.getLogger(__name__)
 
 
+def owner(column) -> str | None:
+    instance = getattr(column, 'owner_instance', None)
+    return None if instance is None else str(instance)
+
+
+def cell_records(column, v, id=None) -> list:
+    '''Error record of a single cell'''
+    return [{'file': owner(column), 'column': column.name, 'id': id,
+             'value': v}]
+
+
+def failed_records(column, exception, failed) -> list:
+    '''Error records of the failing cells of a vectorized check'''
+    file = owner(column)
+    return [{'file': file, 'column': column.name, 'id': id, 'value': v}
+            for id, v in failed.items()]
+
+
+def duplicate_records(column, series) -> list:
+    '''Error records of the non-unique cells of a column'''
+    return failed_records(column, NonUniqueException,
+                          series[series.duplicated(keep=False)])
+
+
 class BaseDescriptor:
     def __get__(self, obj, objtype=None):
         self.owner_instance = obj
@@ -21,7 +46,7 @@ class BaseDescriptor:
         return self.instance(self.owner_instance.df.loc[index, self])
 
     def set_field(self, index: Index, value):
-        self.owner_instance.df.loc[index, self] = value
+        self.owner_instance.set_value(index, self, value)
 
     def column(self):
         return self.owner_instance.df[self].apply(self.instance)
@@ -33,6 +58,7 @@ class BaseColumn(BaseDescriptor):
     '''
     dtype = object
     instance = ColumnField
+    invalid = InvalidPatternException
     empty = True
     unique = False
 
@@ -49,31 +75,71 @@ class BaseColumn(BaseDescriptor):
     def __repr__(self):
         return f'{self.__class__.__name__}({self.name})'
 
-    @catch(logger)
-    def _check_instance(self, v):
+    @catch(logger, records=cell_records)
+    def _check_instance(self, v, id=None):
         return self.instance(v)
 
-    @catch(logger)
-    def _check_empty(self, v):
+    @catch(logger, records=cell_records)
+    def _check_empty(self, v, id=None):
         if pd.isna(v):
             raise EmptyFieldException(self, v)
 
     @log(logger)
     def check_instance(self, series):
-        for _, v in enumerate(series):
-            self._check_instance(v)
+        for id, v in series.items():
+            self._check_instance(v, id)
 
     @log(logger)
     def check_empty(self, series):
-        for _, v in enumerate(series):
-            self._check_empty(v)
+        for id, v in series.items():
+            self._check_empty(v, id)
 
     @log(logger)
+    @catch(logger, records=duplicate_records)
     def check_unique(self, series):
         if not series.is_unique:
-            raise NonUniqueException(self)
+            duplicated = series.duplicated(keep=False)
+            raise NonUniqueException(self, series.index[duplicated].tolist())
+
+    def match(self, series) -> pd.Series:
+        return self.instance.match(series)
+
+    def failed(self, series) -> dict:
+        '''Failing values per exception, all cells checked at once'''
+        notna = series.notna()
+        masks = {self.invalid: notna & ~self.match(series)}
+        if self.unique:
+            masks[NonUniqueException] = notna & series.duplicated(keep=False)
+        if not self.empty:
+            masks[EmptyFieldException] = ~notna
+        return {e: series[m.to_numpy()] for e, m in masks.items()}
+
+    @catch(logger, records=failed_records, raise_errors=False)
+    def _check_failed(self, exception, failed):
+        if not failed.empty:
+            raise exception(self, failed.index.tolist())
+
+    @log(logger)
+    def check(self, series) -> pd.DataFrame:
+        '''
+        Vectorized validate, report of failing ids per check
+
+        Failures are collected whatever the policy, so every column is
+        checked and reported. SpocFile.validate applies the policy.
+        '''
+        report = []
+        for exception, failed in self.failed(series).items():
+            self._check_failed(exception, failed)
+            report.extend((self.name, id, v, exception.__name__)
+                          for id, v in failed.items())
+        return pd.DataFrame(
+            report, columns=['column', 'id', 'value', 'exception'],
+            dtype=object)
+
+    def validate(self, series, vectorized=False):
+        if vectorized:
+            return self.check(series)
 
-    def validate(self, series):
         self.check_instance(series.dropna())
         if self.unique:
             self.check_unique(series.dropna())
@@ -120,6 +186,10 @@ class Param(Column):
 
 class TagParam(Param):
     instance = Tag.parse
+    invalid = InvalidTagPatternException
+
+    def match(self, series) -> pd.Series:
+        return Tag.match(series)
 
 
 class FileParam(Param):
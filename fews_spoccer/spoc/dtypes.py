@@ -1,4 +1,5 @@
 import re
+import functools
 from typing import Self
 
 import numpy as np
@@ -31,6 +32,13 @@ class BaseField:
         if not re.match(self.regexp, self.value):
             raise InvalidPatternException
 
+    @classmethod
+    def match(cls, series: pd.Series) -> pd.Series:
+        '''Vectorized validate, True where a value is a valid field'''
+        if not cls.regexp:
+            return pd.Series(True, index=series.index)
+        return series.str.match(cls.regexp, na=False)
+
 
 class ColumnField(BaseField):
     def concat(self, *fields, sep='_'):
@@ -70,6 +78,8 @@ class Tag:
         re.compile(avic_tag),
         re.compile(vaarweg_tag)
     )
+    columns = ('prefix', 'area', 'name', 'legger_code', 'param', 'is_muted',
+               'location', 'filename')
 
     def __init__(self, tag: str, map=None):
         self.tag = tag
@@ -80,7 +90,7 @@ class Tag:
 
     @property
     def location(self):
-        return self.map.get('legger_code', self.map['name'])
+        return self.map.get('legger_code') or self.map['name']
 
     @property
     def is_muted(self):
@@ -88,23 +98,73 @@ class Tag:
 
     def filename(self):
         exclude = ('marker1', 'prefix', 'tag_type', 'suffix', 'marker2')
-        stem = ''.join(v for k, v in self.map.items() if k not in exclude)
+        stem = ''.join(v for k, v in self.map.items()
+                       if k not in exclude and v is not None)
         return ''.join(i for i in stem if i.isalnum() or i == '_') + '.csv'
 
+    @property
+    def record(self) -> dict:
+        '''Tag attributes as a row of the tag table'''
+        return {
+            'prefix': self.map['prefix'],
+            'area': self.map.get('area'),
+            'name': self.map['name'],
+            'legger_code': self.map.get('legger_code'),
+            'param': self.map.get('param'),
+            'is_muted': self.is_muted,
+            'location': self.location,
+            'filename': self.filename(),
+        }
+
     @staticmethod
     def is_taglike(tag: str) -> bool:
         if isinstance(tag, str):
             return len(tag) > 25 and tag.count('.') > 4
         return False
 
+    @classmethod
+    def match(cls, series: pd.Series) -> pd.Series:
+        '''Vectorized parse, True where a value is not taglike or valid'''
+        taglike = (series.str.len().gt(25) &
+                   series.str.count(r'\.').gt(4)).to_numpy()
+        matched = np.zeros(len(series), dtype=bool)
+        for pattern in cls.patterns:
+            unmatched = taglike & ~matched
+            matched[unmatched] = series[unmatched].str.match(
+                pattern).to_numpy(dtype=bool)
+        return pd.Series(~taglike | matched, index=series.index)
+
     @classmethod
     def parse(cls, tag: str) -> Self:
         if not cls.is_taglike(tag):
             return np.nan
 
+        parsed = cls._parse(tag)
+        if parsed is None:
+            raise InvalidTagPatternException(tag)
+        return parsed
+
+    @classmethod
+    @functools.lru_cache(maxsize=2**16)
+    def _parse(cls, tag: str) -> Self | None:
+        '''Parse a tag string once, None if it matches no pattern'''
         for pattern in cls.patterns:
             match = re.match(pattern, tag)
             if match:
                 return cls(tag, match.groupdict())
-        else:
-            raise InvalidTagPatternException(tag)
+
+    @classmethod
+    def table(cls, tags: pd.Series) -> pd.DataFrame:
+        '''
+        Parse a column of tags into a table indexed by tag string
+
+        Every unique tag is parsed once, values that are not
+        taglike or do not match any tag pattern are left out.
+        '''
+        records = {}
+        for tag in pd.unique(pd.Series(tags).dropna()):
+            parsed = cls._parse(tag) if cls.is_taglike(tag) else None
+            if parsed is not None:
+                records[tag] = parsed.record
+        return pd.DataFrame.from_dict(
+            records, orient='index', columns=list(cls.columns))
@@ -40,3 +40,11 @@ class MutedTagException(SpoccerException):
 
 class TagNotInViewException(SpoccerException):
     pass
+
+
+class SpocFileLoadException(SpoccerException):
+    pass
+
+
+class SpocFileValidationException(SpoccerException):
+    pass
@@ -1,8 +1,11 @@
 import itertools as it
+from typing import Self
 
 import numpy as np
 import pandas as pd
 
+from .dtypes import Tag
+
 
 class IndexField(dict):
     def __init__(self, map):
@@ -18,6 +21,67 @@ class IndexField(dict):
         return all(self.exists(s) for s in spocfiles)
 
 
+class Matches:
+    '''
+    Param matches of many Indexes in one table
+
+    Columnar counterpart of IndexField with columns indexfile,
+    id, param, file (H2GO file key), tag and location.
+
+    Params without a related TagParam, like HANDH, have a missing tag, so
+    their IndexFields hold a NaN tag instead of leaving the tag key out.
+    IndexField.exists is False for both.
+    '''
+    def __init__(self, df: pd.DataFrame, spocfiles: dict):
+        self.df = df
+        self.spocfiles = spocfiles
+
+        self._groups = None
+
+    def __len__(self):
+        return len(self.df)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)})'
+
+    def exists(self, column: str) -> pd.Series:
+        return self.df[column].notna()
+
+    def is_empty(self, columns: list[str]) -> pd.Series:
+        return ~self.df[list(columns)].notna().any(axis=1)
+
+    def exists_all(self, columns: list[str]) -> pd.Series:
+        return self.df[list(columns)].notna().all(axis=1)
+
+    def select(self, mask: pd.Series) -> Self:
+        return self.__class__(self.df[mask], self.spocfiles)
+
+    def positions(self, *ids: str) -> np.ndarray:
+        if self._groups is None:
+            self._groups = self.df.groupby('id', sort=False).indices
+        groups = [self._groups.get(id, []) for id in ids]
+        return np.concatenate([[], *groups]).astype(int)
+
+    def select_ids(self, *ids: str) -> Self:
+        return self.__class__(self.df.iloc[self.positions(*ids)],
+                              self.spocfiles)
+
+    def set_data(self, indexer):
+        '''Set IndexFields of the sublocations of indexer'''
+        rows = {}
+        for row in self.df[['id', 'param', 'file', 'tag']].itertuples(
+                index=False, name=None):
+            rows.setdefault(row[0], []).append(row)
+
+        for index in indexer.sublocations():
+            filefile, tagfile = self.spocfiles[index.indexfile]
+            index.set_data(
+                {'id': id, 'param': param, filefile: file,
+                 tagfile: Tag.parse(tag)}
+                for id, param, file, tag in rows.get(index.id, []))
+            index.spocfiles = [filefile, tagfile]
+
+
 class Index:
     def __init__(self, id, indexfile):
         self.id = id
@@ -87,15 +151,13 @@ class Indexer:
                 yield index, field
 
     def get_sync_level(self, column: str):
+        registry = self.spoccer.registry
+
         levels = []
         for index in self:
-            spoc_obj = getattr(self.spoccer, index.indexfile)
-            field = getattr(spoc_obj, column).field(index)
-            levels.append(field)
-            for spocfile in index.spocfiles:
-                spoc_obj = getattr(self.spoccer, spocfile)
-                field = getattr(spoc_obj, column).field(index)
-                levels.append(field)
+            for spocfile in (index.indexfile, *index.spocfiles):
+                spoc_obj = registry[spocfile]
+                levels.append(getattr(spoc_obj, column).field(index))
 
         if not all(level == levels[0] for level in levels):
             raise ValueError('Inconsistent sync levels')
@@ -109,9 +171,8 @@ class Indexer:
     def set_sync_level(self, level: str, sync_column: str):
         self.check_sync_level(level, sync_column)
 
+        registry = self.spoccer.registry
         for index in self:
-            spoc_obj = getattr(self.spoccer, index.indexfile)
-            getattr(spoc_obj, sync_column).set_field(index, level)
-            for spocfile in index.spocfiles:
-                spoc_obj = getattr(self.spoccer, spocfile)
+            for spocfile in (index.indexfile, *index.spocfiles):
+                spoc_obj = registry[spocfile]
                 getattr(spoc_obj, sync_column).set_field(index, level)
@@ -1,5 +1,9 @@
+import itertools as it
+
+import pandas as pd
+
 from .spocfile import SpocFile
-from .indexer import Indexer, Index
+from .indexer import Indexer, Index, Matches
 from .ctypes import (
     Column, HLColumn, SLColumn, WSColumn, TagParam, FileParam,
     XColumn, YColumn)
@@ -24,6 +28,8 @@ class HL(SpocFile):
     oc_test = Column('OC_TEST')
     oc_prod = Column('OC_PROD')
 
+    _matches = None
+
     def __init__(self, spoccer):
         super().__init__()
         self.spoccer = spoccer
@@ -41,9 +47,35 @@ class HL(SpocFile):
         ws = [Index(i, indexfile=str(ws)) for i in ws.ids_by_pids(id)]
         return Indexer(self.spoccer, hl, sl, ws)
 
+    def sublocations_many(self, ids: list[str]) -> dict[str, Indexer]:
+        '''Indexers of many HL ids at once, ids not in HL are left out'''
+        index = self.df.index
+        return {id: self.sublocations(id) for id in dict.fromkeys(ids)
+                if id in index}
+
+    def param_matches(self, indexer: Indexer = None) -> Matches:
+        '''
+        Param matches of all sublocations, or of those in indexer
+
+        The whole tree is matched at once and reused
+        until one of the matched SpocFiles is modified.
+        '''
+        spocfiles = (self.sl, self.ws)
+        version = tuple(s.version for s in (*spocfiles, *it.chain(*spocfiles)))
+        if self._matches is None or self._matches[0] != version:
+            matches = Matches(
+                pd.concat([s.param_matches(s.df.index) for s in spocfiles],
+                          ignore_index=True),
+                {str(s): s.match_spocfiles() for s in spocfiles})
+            self._matches = version, matches
+
+        matches = self._matches[1]
+        if indexer is not None:
+            return matches.select_ids(*(i.id for i in indexer.sublocations()))
+        return matches
+
     def get_param_matches(self, indexer: Indexer) -> Indexer:
-        for index in indexer.sublocations():
-            getattr(self, index.indexfile).get_param_matches(index)
+        self.param_matches(indexer).set_data(indexer)
         return indexer
 
 
@@ -84,10 +116,6 @@ class SL(SpocFile):
         return iter((self.sl_tags, self.sl_ti_h2go_tags, self.damo_pomp,
                      self.damo_stuw))
 
-    def get_param_matches(self, index: Index) -> None:
-        index.set_data(super().get_param_matches(self.sl_ti_h2go_tags, index))
-        index.spocfiles = [str(self.sl_ti_h2go_tags), str(self.sl_tags)]
-
 
 class WS(SpocFile):
     id = WSColumn('ï»¿CODE')
@@ -119,10 +147,6 @@ class WS(SpocFile):
     def __iter__(self):
         return iter((self.ws_tags, self.ws_ti_h2go_tags, self.ws_validatie))
 
-    def get_param_matches(self, index: Index) -> None:
-        index.set_data(super().get_param_matches(self.ws_ti_h2go_tags, index))
-        index.spocfiles = [str(self.ws_ti_h2go_tags), str(self.ws_tags)]
-
 
 class SL_TAGS(SpocFile):
     shortname = Column('SHORTNAME')
@@ -156,9 +180,6 @@ class SL_TAGS(SpocFile):
     def __init__(self):
         super().__init__()
 
-    def get_param_value(self, index: Index, param: TagParam):
-        return super().field(index, param)
-
 
 class SL_TI_H2GO_TAGS(SpocFile):
     id = SLColumn('SL_CODE')
@@ -189,9 +210,9 @@ class SL_TI_H2GO_TAGS(SpocFile):
     def __init__(self):
         super().__init__()
 
-    def get_param_value(self, index: Index, param: FileParam):
-        return super().field(index, self.h2go_locid).concat(
-            super().field(index, param))
+    def param_values(self, ids: pd.Index) -> pd.DataFrame:
+        locid = self.df[self.h2go_locid].reindex(ids)
+        return super().param_values(ids).apply(lambda v: locid + '_' + v)
 
 
 class DAMO_pomp(SpocFile):
@@ -262,9 +283,6 @@ class WS_TAGS(SpocFile):
     def __init__(self):
         super().__init__()
 
-    def get_param_value(self, index: Index, param: TagParam):
-        return super().field(index, param)
-
 
 class WS_TI_H2GO_TAGS(SpocFile):
     naam = Column('NAAM')
@@ -287,9 +305,9 @@ class WS_TI_H2GO_TAGS(SpocFile):
     def __init__(self):
         super().__init__()
 
-    def get_param_value(self, index: Index, param: FileParam):
-        return super().field(index, self.h2go_locid).concat(
-            super().field(index, param))
+    def param_values(self, ids: pd.Index) -> pd.DataFrame:
+        locid = self.df[self.h2go_locid].reindex(ids)
+        return super().param_values(ids).apply(lambda v: locid + '_' + v)
 
 
 class WS_VALIDATIE(SpocFile):
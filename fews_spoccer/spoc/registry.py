@@ -0,0 +1,76 @@
+from .ctypes import BaseColumn
+
+
+class Registry:
+    '''
+    Lookup of SpocFiles by name and of their relations
+
+    Built once from the SpocFile tree, it holds the children of each
+    index file, the owner of each column, the TagParam related to each
+    Param, the SpocFiles matched by each index file and the column
+    linking each SpocFile to its parent. SpocFiles hold the registry
+    they are in.
+    '''
+    def __init__(self, tree):
+        self.spocfiles = {}
+        self.children = {}
+        self.parents = {}
+        self.links = {}
+        self.owners = {}
+        self.relations = {}
+        self.matches = {}
+
+        for indexfile in tree:
+            parent = str(indexfile)
+            self.spocfiles.setdefault(parent, indexfile)
+            self.children[parent] = []
+            for relation in indexfile:
+                if relation is indexfile:
+                    continue
+                self.spocfiles[str(relation)] = relation
+                self.children[parent].append(str(relation))
+                self.parents[str(relation)] = parent
+
+        for name, spocfile in self.spocfiles.items():
+            for column in spocfile.cls_attrs(BaseColumn).values():
+                self.owners.setdefault(column, spocfile)
+
+            if name in self.parents:
+                self.links[name] = getattr(spocfile, 'pid', spocfile.id)
+
+        for param, spocfile in self.owners.items():
+            if getattr(param, 'relation', None) is not None:
+                self.relations[param] = param.relation
+
+        # index file: its child with related Params and their owner
+        for parent, children in self.children.items():
+            for child in children:
+                for param in self.spocfiles[child].Params:
+                    if param in self.relations:
+                        self.matches[parent] = (
+                            child, str(self.owners[self.relations[param]]))
+                        break
+
+        for spocfile in self.spocfiles.values():
+            spocfile.registry = self
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({list(self.spocfiles)})'
+
+    def __iter__(self):
+        return iter(self.spocfiles.values())
+
+    def __contains__(self, name):
+        return name in self.spocfiles
+
+    def __getitem__(self, name):
+        return self.spocfiles[name]
+
+    def related(self, name: str) -> list:
+        '''Related SpocFiles of an index file, itself included'''
+        return [name, *self.children.get(name, [])]
+
+    def tag_params(self, name: str) -> dict:
+        '''Names of the TagParams related to the Params of a SpocFile'''
+        return {self.relations[p].name: p.param
+                for p in self.spocfiles[name].Params if p in self.relations}
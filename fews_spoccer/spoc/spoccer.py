@@ -1,7 +1,16 @@
 import logging
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+import numpy as np
+import pandas as pd
+
+from .cache import SpocCache
+from .registry import Registry
+from .indexer import Indexer
 from .maplayerfiles import HL
-from ..utils import log
+from ..utils import log, collect
+from .etypes import SpocFileLoadException
 
 
 logger = logging.getLogger(__name__)
@@ -13,56 +22,199 @@ class Spoccer:
 
     Use the lower case class name as
     instance attribute to include a tree relation.
+
+    With a cachepath, loaded and validated SpocFiles are
+    cached on disk and reused while their source is unchanged.
+
+    Exceptions caught while validating or running a module are
+    collected in errors, see ErrorCollector.
     '''
-    def __init__(self, srcpath, dstpath, read_kw, write_kw):
+    def __init__(self, srcpath, dstpath, read_kw, write_kw, workers=None,
+                 cachepath=None):
         self.srcpath = srcpath
         self.dstpath = dstpath
         self.read_kw = read_kw
         self.write_kw = write_kw
+        self.workers = workers
+
+        self.cache = None
+        if cachepath is not None:
+            self.cache = SpocCache(cachepath, read_kw)
 
         self.hl = HL(self)
+        self.registry = Registry(self.hl)
 
         self.module = None
+        self.errors = None
 
     def __repr__(self):
         return f'<{self.__class__.__name__}()>'
 
     def __iter__(self):
         '''Iterate over SpocFiles'''
-        for indexfile in self.hl:
-            for relation in indexfile:
-                yield relation
+        return iter(self.registry)
 
     def __getattr__(self, k):
         '''Convenience method to assess SpocFile directly'''
-        for obj in self:
-            if k == str(obj).lower():
-                return obj
+        registry = self.__dict__.get('registry')
+        if registry is not None and k in registry:
+            return registry[k]
 
-        raise AttributeError
+        raise AttributeError(k)
 
-    @log(logger, logging.INFO)
-    def load(self):
-        '''Load SpocFiles in tree'''
-        for relation in self:
+    def _load(self, relation):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(Path(self.srcpath) / relation.filename)
+
+        if key is None or not relation.read_cache(
+                self.cache, self.srcpath, key):
             relation.read(self.srcpath, **self.read_kw)
             relation.set_index()
             relation.convert_dtypes()
 
+            if key is not None:
+                relation.write_cache(self.cache, key)
+
+        relation.set_synced(self.srcpath)
+        relation.build_groups()
+
     @log(logger, logging.INFO)
-    def save(self):
-        '''Save SpocFiles in tree'''
-        for relation in self:
-            relation.write(self.dstpath, **self.write_kw)
+    def load(self, workers=None):
+        '''
+        Load SpocFiles in tree
+
+        With workers, the SpocFiles are loaded concurrently in
+        a thread pool. Failing files are logged and raised together.
+        '''
+        workers = workers or self.workers
+        if not workers:
+            for relation in self:
+                self._load(relation)
+            return
+
+        errors = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._load, r): r for r in self}
+            for future in as_completed(futures):
+                relation = futures[future]
+                if future.exception() is not None:
+                    errors[str(relation)] = future.exception()
+                    logger.error(
+                        f'spoccer - load - {relation} - '
+                        f'{repr(future.exception())}')
+        if errors:
+            raise SpocFileLoadException(errors)
 
     @log(logger, logging.INFO)
-    def validate(self):
-        '''Validate SpocFiles'''
+    def save(self, force=False):
+        '''Save SpocFiles in tree that differ from their file in dstpath'''
         for relation in self:
-            relation.validate()
+            if force or relation.is_dirty(self.dstpath):
+                relation.write(self.dstpath, **self.write_kw)
+
+    @log(logger, logging.INFO)
+    def validate(self, vectorized=False):
+        '''
+        Validate SpocFiles
+
+        The vectorized mode checks whole columns at once
+        and returns a report of all failing ids per column,
+        it raises under the same policy as the per cell mode.
+        Only SpocFiles without failures are cached as validated.
+        '''
+        reports = []
+        with collect(logger) as self.errors:
+            for relation in self:
+                if relation.validated:
+                    logger.debug(f'spoccer - validate - {relation} - cached')
+                    continue
+
+                caught = self.errors.total()
+                report = relation.validate(vectorized)
+                reports.append(report)
+                failed = self.errors.total() > caught or (
+                    vectorized and not report.empty)
+
+                if self.cache is not None and not failed:
+                    self.cache.set_validated(relation, relation.cache_key)
+                    relation.validated = True
+
+        if vectorized and reports:
+            return pd.concat(reports, ignore_index=True)
+        if vectorized:
+            return pd.DataFrame(
+                columns=['spocfile', 'column', 'id', 'value', 'exception'])
+
+    def sync_files(self) -> list:
+        '''SpocFiles holding the sync level of an HL and its sublocations'''
+        sl, ws = self.hl.sl, self.hl.ws
+        return [self.hl, sl, ws, *(self.registry[name] for name in
+                                   (*sl.match_spocfiles(),
+                                    *ws.match_spocfiles()))]
+
+    def hl_ids(self, spocfile) -> np.ndarray:
+        '''HL id of every row in spocfile, following the parent links'''
+        name = str(spocfile)
+        if name not in self.registry.parents:
+            return spocfile.df.index.to_numpy()
 
-    def pre(self, id, sync_column):
-        indexer = self.hl.sublocations(id)
+        parent = self.registry[self.registry.parents[name]]
+        parent_ids = pd.Series(self.hl_ids(parent), index=parent.df.index)
+        link = spocfile.df[self.registry.links[name]]
+        return link.map(parent_ids).to_numpy()
+
+    @log(logger, logging.INFO)
+    def sync_status(self, *sync_columns: str) -> pd.DataFrame:
+        '''
+        Sync level of every HL per sync column
+
+        The level is only set if the HL and all rows of its
+        sublocations agree, next is the level it may move to.
+        '''
+        ranks = {k: v for k, v in Indexer.levels.items() if pd.notna(k)}
+        levels_by_rank = {v: k for k, v in Indexer.levels.items()}
+
+        status = pd.DataFrame(index=self.hl.df.index)
+        for sync_column in sync_columns or ('oc_test', 'oc_prod'):
+            levels = pd.concat([
+                pd.Series(s.df[getattr(s, sync_column)].to_numpy(),
+                          index=self.hl_ids(s), dtype=object)
+                for s in self.sync_files()])
+            grouped = levels[levels.index.notna()].groupby(level=0)
+
+            consistent = grouped.nunique(dropna=False) == 1
+            current = grouped.first()
+            current = current.where(consistent & current.notna())
+            rank = current.map(ranks).fillna(-1)
+
+            status[sync_column] = current
+            status[f'{sync_column}_consistent'] = consistent
+            status[f'{sync_column}_next'] = (rank + 1).map(
+                levels_by_rank).where(consistent)
+        return status
+
+    @log(logger, logging.INFO)
+    def set_sync_levels(self, ids, level: str, sync_column: str) -> pd.Index:
+        '''
+        Set the sync level of many HLs with one assignment per SpocFile
+
+        Returns the ids that cannot move to level, these are left as is.
+        '''
+        ids = pd.Index(ids)
+        status = self.sync_status(sync_column)
+        allowed = (status[f'{sync_column}_next'].reindex(ids) == level)\
+            .to_numpy()
+
+        for spocfile in self.sync_files():
+            rows = np.isin(self.hl_ids(spocfile), ids[allowed])
+            if rows.any():
+                spocfile.set_value(rows, getattr(spocfile, sync_column), level)
+        return ids[~allowed]
+
+    def pre(self, id, sync_column, indexer=None):
+        if indexer is None:
+            indexer = self.hl.sublocations(id)
         indexer.check_sync_level(self.module.sync_level, sync_column)
         indexer = self.module.pre(indexer)
         return indexer
@@ -79,7 +231,44 @@ class Spoccer:
         self.module.validate(indexer)
 
     def run_module(self, id, sync_column):
-        indexer = self.pre(id, sync_column)
-        self.module.run(indexer)
+        with collect(logger) as self.errors:
+            indexer = self.pre(id, sync_column)
+            self.module.run(indexer)
         self.post(indexer, sync_column)
         return indexer
+
+    @log(logger, logging.INFO)
+    def run_modules(self, ids, sync_column) -> dict:
+        '''
+        Run module for many HL ids with a single save
+
+        Use hl.ids_by_sync_level to select all HLs at a level.
+        Exceptions are collected per id and returned.
+        '''
+        indexers, errors = {}, {}
+        sublocations = self.hl.sublocations_many(ids)
+        with collect(logger) as self.errors:
+            for id in ids:
+                try:
+                    indexers[id] = self.pre(
+                        id, sync_column, sublocations.get(id))
+                except Exception as e:
+                    errors[id] = e
+
+            try:
+                failed = self.module.run_many(list(indexers.values()))
+            except Exception as e:
+                failed = dict.fromkeys(indexers.values(), e)
+        for id, indexer in indexers.items():
+            if indexer in failed:
+                errors[id] = failed[indexer]
+
+        done = [id for id in indexers if id not in errors]
+        for id in self.set_sync_levels(
+                done, self.module.sync_level, sync_column):
+            errors[id] = ValueError('Cannot skip sync levels')
+        self.save()
+
+        for id, e in errors.items():
+            logger.error(f'spoccer - run_modules - {id} - {repr(e)}')
+        return errors
@@ -1,11 +1,17 @@
+import os
+import bisect
+import hashlib
 import logging
-from typing import Self
+import filecmp
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
-from ..utils import log
+from ..utils import log, raises, mkstemp, replace
 from .indexer import Index
+from .dtypes import Tag
+from .etypes import SpocFileValidationException
 from .ctypes import Column, Param
 
 
@@ -19,8 +25,16 @@ class SpocFile:
     Use this class by subclassing it with
     the exact same name as the file to be read.
     '''
+    cache_key = None
+    validated = False
+    version = 0
+    registry = None
+
+    _groups = None
+
     def __init__(self):
         self._df = None
+        self._synced = {}           # filepath: digest of its content
 
         # assign owner instance to descriptor
         for name in self.__class__.__dict__:
@@ -63,17 +77,133 @@ class SpocFile:
     def Params(cls):
         return cls.cls_attrs(Param).values()
 
+    @property
+    def group_by(self):
+        '''Parent id column to group ids by, if any'''
+        return getattr(self, 'pid', None)
+
+    def digest(self) -> bytes:
+        '''Hash of the columns and values of the DataFrame'''
+        values = pd.util.hash_pandas_object(self.df, index=False)
+        return hashlib.sha1(
+            repr(list(self.df.columns)).encode() + values.to_numpy().tobytes()
+            ).digest()
+
+    def set_synced(self, path):
+        '''Record the DataFrame as equal to the file in path'''
+        self._synced[(Path(path) / self.filename).resolve()] = self.digest()
+
+    def is_dirty(self, path) -> bool:
+        '''
+        DataFrame differs from the file in path
+
+        Compares the content of the DataFrame with the content it had when
+        synced, so direct modifications of df are seen. A file not synced
+        is clean if it equals a synced file of the same content, it is
+        synced from then on and later checks cost a single hash.
+        '''
+        filepath = (Path(path) / self.filename).resolve()
+        digest = self.digest()
+        if self._synced.get(filepath) == digest:
+            return False
+        if any(synced == digest and filepath.is_file()
+               and filecmp.cmp(other, filepath, shallow=False)
+               for other, synced in list(self._synced.items())):
+            self._synced[filepath] = digest
+            return False
+        return True
+
+    def set_value(self, index, column, value):
+        if self._groups is not None and column is self.group_by:
+            self._regroup(index, value)
+        self.df.loc[index, column] = value
+        self.version += 1
+
+    @log(logger)
+    def build_groups(self):
+        '''
+        Index row positions by parent id, or by id if ids are not unique
+
+        Kept up to date by set_value, so lookups of ids by parent id and
+        of the rows of non-unique ids take constant time. Replacing df
+        drops the groups until they are rebuilt, direct writes to the
+        parent id column of df are not seen.
+        '''
+        if self.group_by is not None:
+            keys = self.df[self.group_by].to_numpy()
+        elif not self.df.index.is_unique:
+            keys = self.df.index.to_numpy()
+        else:
+            return
+
+        self._groups = {k: list(v) for k, v in
+                        self.df.groupby(keys, sort=False).indices.items()}
+
+    def _regroup(self, index, value):
+        labels = np.atleast_1d(index() if isinstance(index, Index) else index)
+        positions = self.df.index.get_indexer_for(labels)
+        for position, key in zip(
+                positions, self.df[self.group_by].iloc[positions]):
+            if pd.notna(key):
+                self._groups[key].remove(position)
+            if pd.notna(value):
+                bisect.insort(self._groups.setdefault(value, []), position)
+
+    def positions(self, *keys) -> np.ndarray:
+        '''Sorted row positions of the groups of keys'''
+        groups = [self._groups.get(k, []) for k in keys]
+        return np.sort(np.concatenate([[], *groups]).astype(int))
+
+    def rows(self, *keys) -> pd.DataFrame:
+        '''Rows of the groups of keys, all rows of an id if not unique'''
+        if self._groups is None:
+            column = self.df.index if self.group_by is None else \
+                self.df[self.group_by]
+            return self.df[column.isin(keys)]
+        return self.df.iloc[self.positions(*keys)]
+
     @log(logger)
     def read(self, srcpath, **read_kw):
         self._df = pd.read_csv(Path(srcpath) / self.filename, **read_kw)
+        self._groups = None
+        self._synced = {}
+        self.version += 1
+
+    @log(logger)
+    def read_cache(self, cache, srcpath, key: list) -> bool:
+        entry = cache.get(self, key)
+        if entry is None:
+            return False
+
+        self._df, self.validated = entry
+        self._groups = None
+        self._synced = {}
+        self.cache_key = key
+        self.version += 1
+        return True
+
+    @log(logger)
+    def write_cache(self, cache, key: list):
+        cache.put(self, key)
+        self.cache_key = key
+        self.validated = False
 
     @log(logger)
     def write(self, dstpath, **write_kw):
-        self.df.to_csv(Path(dstpath) / self.filename, **write_kw)
+        '''Write to a temporary file and replace the target at once'''
+        fd, tmppath = mkstemp(dstpath, prefix=f'.{self.filename}-')
+        os.close(fd)
+        try:
+            self.df.to_csv(tmppath, **write_kw)
+            replace(tmppath, Path(dstpath) / self.filename)
+        finally:
+            tmppath.unlink(missing_ok=True)
+        self.set_synced(dstpath)
 
     @log(logger)
     def set_index(self):
         self._df = self.df.set_index(self.df[self.id])
+        self._groups = None
 
     @log(logger)
     def convert_dtypes(self):
@@ -84,33 +214,69 @@ class SpocFile:
                 logger.debug(f'{self}@{column} to {column.dtype}')
 
     @log(logger)
-    def validate(self):
+    def validate(self, vectorized=False):
+        '''
+        Validate all columns, per cell or vectorized
+
+        Vectorized, all columns are checked before the policy applies:
+        failures are raised together with their report, or returned.
+        '''
         logger.debug(f'Validating {self} ...')
-        for column in self.Columns:
-            column.validate(self.df[column])
+        reports = [column.validate(self.df[column], vectorized)
+                   for column in self.Columns]
+        if vectorized:
+            report = pd.concat(reports, ignore_index=True)
+            report.insert(0, 'spocfile', str(self))
+            if not report.empty and raises():
+                raise SpocFileValidationException(self, report)
+            return report
 
     def field(self, id, column):
         return column.field(id)
 
     def ids_by_pids(self, *pids: str) -> pd.Index:
+        if self._groups is not None and self.group_by is not None:
+            return self.df.index[self.positions(*pids)]
         return self.df[self.df[self.pid].isin(pids)].index
 
     def ids_by_area(self, *areas: str) -> pd.Index:
         return self.df[self.df[self.area].isin(areas)].index
 
-    def get_param_matches(self, spocfile: Self, index: Index) -> list[dict]:
-        matches = []
-        for p in spocfile.Params:
-            match = {}
-            match['id'] = index.id
-            match['param'] = p.param
-
-            file_value = p.owner_instance.get_param_value(index, p)
-            match[str(p.owner_instance)] = file_value
-
-            if p.relation is not None:
-                p = p.relation
-                tag_value = p.owner_instance.get_param_value(index, p)
-                match[str(p.owner_instance)] = tag_value
-            matches.append(match)
-        return matches
+    def ids_by_sync_level(self, sync_column: str, level) -> pd.Index:
+        column = self.df[getattr(self, sync_column)]
+        if pd.isna(level):
+            return self.df[column.isna()].index
+        return self.df[column == level].index
+
+    def param_values(self, ids: pd.Index) -> pd.DataFrame:
+        '''Values of all Params for ids, one column per param'''
+        params = {p.name: p.param for p in self.Params}
+        return self.df.reindex(ids)[list(params)].rename(columns=params)
+
+    def match_spocfiles(self) -> tuple[str, str]:
+        '''Names of the Param and TagParam files matched by an index file'''
+        return self.registry.matches[str(self)]
+
+    def param_matches(self, ids: pd.Index) -> pd.DataFrame:
+        '''
+        Params of ids matched with the tags of their related TagParams
+
+        Vectorized over all ids, the relations are read from the registry.
+        '''
+        filename, tagname = self.match_spocfiles()
+        spocfile, tagfile = self.registry[filename], self.registry[tagname]
+        files = spocfile.param_values(ids)
+        matches = pd.DataFrame({
+            'indexfile': str(self),
+            'id': np.repeat(ids.to_numpy(), files.shape[1]),
+            'param': np.tile(files.columns.to_numpy(), len(ids)),
+            'file': files.to_numpy().ravel()})
+
+        params = self.registry.tag_params(filename)
+        tags = tagfile.df.reindex(ids)[list(params)].rename(columns=params)\
+            .rename_axis('id').melt(
+                var_name='param', value_name='tag', ignore_index=False)
+        tags['tag'] = tags.tag.where(tags.tag.map(Tag.is_taglike))
+        matches = matches.merge(tags.reset_index(), on=['id', 'param'],
+                                how='left')
+        return matches.join(Tag.table(matches.tag).location, on='tag')
@@ -1,43 +1,297 @@
 import os
+import stat
+import time
+import uuid
 import logging
 import inspect
+import threading
 import functools
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+
+import pandas as pd
 
 from .spoc.etypes import SpoccerException
 
 
+class Stats:
+    '''
+    Registry of calls, cumulative wall time and exceptions per function
+
+    Filled by functions annotated with log while enabled, without enabled
+    stats it costs a single attribute lookup per call. Every profile has
+    its own stats, so nested and concurrent profiles all record.
+    '''
+    columns = ['calls', 'seconds', 'exceptions']
+    active = ()                     # enabled stats, replaced on change
+    _active_lock = threading.Lock()
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self._records)})'
+
+    @property
+    def enabled(self) -> bool:
+        return self in Stats.active
+
+    def enable(self):
+        with Stats._active_lock:
+            Stats.active = (*Stats.active, self)
+
+    def disable(self):
+        with Stats._active_lock:
+            Stats.active = tuple(s for s in Stats.active if s is not self)
+
+    def reset(self):
+        with self._lock:
+            self._records = {}
+
+    def record(self, name, seconds, failed=False):
+        with self._lock:
+            record = self._records.setdefault(name, [0, 0.0, 0])
+            record[0] += 1
+            record[1] += seconds
+            record[2] += failed
+
+    def to_frame(self) -> pd.DataFrame:
+        '''Stats per function, sorted by seconds'''
+        with self._lock:
+            df = pd.DataFrame.from_dict(
+                self._records, orient='index', columns=self.columns)
+        df['mean'] = df.seconds / df.calls
+        return df.rename_axis('function').sort_values(
+            'seconds', ascending=False)
+
+
+@contextmanager
+def profile(logger, level=logging.INFO, top=20):
+    '''
+    Record stats of annotated calls within the block, log the top calls
+
+        with profile(logger):
+            spoccer.run_module(id, column)
+    '''
+    stats = Stats()
+    stats.enable()
+    try:
+        yield stats
+    finally:
+        stats.disable()
+        if logger.isEnabledFor(level):
+            logger.log(level, 'profile\n' +
+                       stats.to_frame().head(top).to_string())
+
+
 def log(logger, level=logging.DEBUG):
     '''
     Signal execution of the annotated function in logs
+
+    The message is only formatted if the level is enabled, calls are
+    recorded in the enabled stats.
     '''
     def deco(f):
         modulename = inspect.getmodule(f).__name__.split('.')[-1]
         msg = f'{modulename} - {f.__name__} - {{self}} - OK'
+        name = f'{modulename}.{f.__qualname__}'
 
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
-            response = f(*args, **kwargs)
-            logger.log(level, msg.format(self=args[0]))
+            active = Stats.active
+            if active:
+                t = time.perf_counter()
+                try:
+                    response = f(*args, **kwargs)
+                except BaseException:
+                    t = time.perf_counter() - t
+                    for stats in active:
+                        stats.record(name, t, True)
+                    raise
+                t = time.perf_counter() - t
+                for stats in active:
+                    stats.record(name, t)
+            else:
+                response = f(*args, **kwargs)
+
+            if logger.isEnabledFor(level):
+                logger.log(level, msg.format(self=args[0]))
             return response
         return wrapper
     return deco
 
 
-def catch(logger, exceptions=(SpoccerException,)):
+def raise_policy() -> bool:
+    '''RAISE environment variable, 1 raises and 0 catches'''
+    return bool(int(os.environ.get('RAISE', 1)))
+
+
+def raises() -> bool:
+    '''Policy of the active collector, else of RAISE'''
+    errors = ErrorCollector.active.get()
+    return raise_policy() if errors is None else errors.raise_errors
+
+
+class ErrorCollector:
+    '''
+    Structured records of the exceptions caught by catch
+
+    A record holds the file, column, id and value an exception was
+    raised for, duplicates are counted instead of repeated. The active
+    collector is a context variable, threads only share it if they run
+    in a copy of the context of collect.
+    '''
+    active = contextvars.ContextVar('active', default=None)
+    columns = ['function', 'file', 'column', 'id', 'value', 'exception']
+
+    def __init__(self, raise_errors=None):
+        self.raise_errors = raise_policy() if raise_errors is None \
+            else raise_errors
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({len(self)})'
+
+    def __len__(self):
+        return len(self._counts)
+
+    def add(self, function, exception, records):
+        with self._lock:
+            for r in records:
+                value = r.get('value')
+                key = (function, r.get('file'), r.get('column'), r.get('id'),
+                       None if value is None else str(value),
+                       type(exception).__name__)
+                self._counts[key] = self._counts.get(key, 0) + 1
+
+    def total(self) -> int:
+        '''Number of caught exceptions, duplicates included'''
+        with self._lock:
+            return sum(self._counts.values())
+
+    def counts(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+    def merge(self, counts: dict):
+        '''Add the counts of another collector, e.g. of a worker'''
+        with self._lock:
+            for key, n in counts.items():
+                self._counts[key] = self._counts.get(key, 0) + n
+
+    def to_frame(self) -> pd.DataFrame:
+        '''Distinct records and the number of times they were raised'''
+        with self._lock:
+            df = pd.DataFrame(list(self._counts), columns=self.columns,
+                              dtype=object)
+            df['count'] = list(self._counts.values())
+        return df
+
+    def to_csv(self, path, **kwargs):
+        self.to_frame().to_csv(path, index=False, **kwargs)
+
+    def summary(self) -> pd.Series:
+        '''Number of distinct records per function, file and exception'''
+        return self.to_frame().groupby(
+            ['function', 'file', 'column', 'exception'], dropna=False).size()
+
+
+@contextmanager
+def collect(logger, raise_errors=None):
+    '''
+    Collect exceptions caught by catch within the block
+
+    The policy is read once, on entry. Caught exceptions are recorded
+    instead of logged per call and summarized on exit. Nested blocks
+    share the collector of the outermost one.
+    '''
+    errors = ErrorCollector.active.get()
+    if errors is not None:
+        yield errors
+        return
+
+    errors = ErrorCollector(raise_errors)
+    token = ErrorCollector.active.set(errors)
+    try:
+        yield errors
+    finally:
+        ErrorCollector.active.reset(token)
+        if len(errors):
+            for key, n in errors.summary().items():
+                key = ' - '.join(str(k) for k in key if pd.notna(k))
+                logger.error(f'{key} - {n} records')
+
+
+def value_records(obj, *args, **kwargs) -> list:
+    return [{'value': args[0] if args else None}]
+
+
+def catch(logger, exceptions=(SpoccerException,), records=value_records,
+          raise_errors=None):
     '''
     Raise or catch exceptions in the annotated function
+
+    Within collect, caught exceptions are passed to the collector as the
+    records of the call args, else logged per call. raise_errors fixes
+    the policy of the function, None follows the collector or RAISE.
     '''
     def deco(f):
+        modulename = inspect.getmodule(f).__name__.split('.')[-1]
+        name = f'{modulename}.{f.__qualname__}'
+
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
+            errors = ErrorCollector.active.get()
             # raise
-            if bool(int(os.environ.get('RAISE', 1))):
+            if raises() if raise_errors is None else raise_errors:
                 return f(*args, **kwargs)
             # catch
             try:
                 return f(*args, **kwargs)
             except exceptions as e:
-                modulename = inspect.getmodule(f).__name__.split('.')[-1]
-                logger.error(f'{modulename} - {f.__name__} - {repr(e)}')
+                if errors is not None:
+                    errors.add(name, e, records(*args, **kwargs))
+                else:
+                    logger.error(f'{modulename} - {f.__name__} - {repr(e)}')
         return wrapper
     return deco
+
+
+SCRATCH = '.scratch'
+
+
+def scratch(dstpath) -> Path:
+    '''
+    Private dir of dstpath for the temporary files of the importers
+
+    Files are written here and moved in place once complete. It is on
+    the filesystem of dstpath so the move is atomic, imports only read
+    the files of dstpath itself.
+    '''
+    path = Path(dstpath) / SCRATCH
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def mkstemp(dirpath, prefix='') -> tuple[int, Path]:
+    '''
+    Open a new file with a unique name in dirpath for writing
+
+    Unlike tempfile.mkstemp the file gets the default mode of the umask,
+    as a file written in place would.
+    '''
+    path = Path(dirpath) / f'{prefix}{uuid.uuid4().hex}.tmp'
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    return fd, path
+
+
+def replace(tmppath, filepath):
+    '''Move tmppath over filepath at once, keeping the mode of filepath'''
+    try:
+        os.chmod(tmppath, stat.S_IMODE(os.stat(filepath).st_mode))
+    except FileNotFoundError:
+        pass
+    os.replace(tmppath, filepath)
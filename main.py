@@ -68,7 +68,9 @@ modules = {
             },
             'write_kw': {
                 'index': False
-            }
+            },
+            'concurrency': 4,
+            'query_rate': 1
         }
     }
 }
@@ -0,0 +1,323 @@
+import os
+import sqlite3
+import logging
+import time
+import unittest
+import tempfile
+import datetime as dt
+from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from fews_spoccer.utils import catch, collect, SCRATCH
+from fews_spoccer.spoc.dtypes import Tag
+from fews_spoccer.spoc.etypes import SpoccerException
+from fews_spoccer.modules.imports.cgoo import CGOOBase, Partition
+from fews_spoccer.modules.imports.catalog import TagCatalog, file_lock
+from fews_spoccer.modules.imports.offline import (
+    OfflineCGOO, OfflineConnection, generate_history)
+
+
+TAG_FMT = '~SCX.~Watersysteem.Objecten.Altena.Altena.Tags.1.NL*09*{} wtBM{}'
+LOCATIONS = {
+    '000001': [TAG_FMT.format('000001', 'LT-1001.LT-1001_SI.Historic'),
+               TAG_FMT.format('000001', 'LT-1002.LT-1002_SI.Historic')],
+    '000002': [TAG_FMT.format('000002', 'bmp1001.bmp1001_BS.Historic')],
+    '000003': [TAG_FMT.format('000003', 'FY-1001.FY-1001_SI.Historic')],
+    }
+
+logger = logging.getLogger(__name__)
+
+
+@catch(logger)
+def fail(value):
+    raise SpoccerException(value)
+
+
+class CGOOTestCase(unittest.TestCase):
+    startdatetime = dt.datetime(2023, 5, 1)
+    enddatetime = dt.datetime(2023, 8, 1)
+    history_kw = {'step': dt.timedelta(hours=1)}
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.dstpath = self.path / 'dst'
+        self.dstpath.mkdir()
+        self.database = self.path / 'history.db'
+        generate_history(self.database, LOCATIONS, self.startdatetime,
+                         self.enddatetime, **self.history_kw)
+
+    def tearDown(self):
+        for cgoo in getattr(self, '_cgoos', []):
+            for connection in cgoo._connections:
+                connection.close()
+        self.tmpdir.cleanup()
+
+    def cgoo(self, **kw) -> OfflineCGOO:
+        '''Connected OfflineCGOO on the history database'''
+        cgoo = OfflineCGOO(
+            self.dstpath, {'index': False},
+            {'database': self.database}, **kw)
+        cgoo.connect()
+        self._cgoos = [*getattr(self, '_cgoos', []), cgoo]
+        return cgoo
+
+    @staticmethod
+    def tags(location) -> list:
+        return [Tag.parse(tag) for tag in LOCATIONS[location]]
+
+    def outputs(self, dstpath) -> dict:
+        return {p.name: p.read_bytes() for p in Path(dstpath).iterdir()}
+
+
+class TestPool(CGOOTestCase):
+    def test_query_rate(self):
+        '''None should not limit, the class default applies if omitted'''
+        credentials = {'database': self.database}
+        self.assertIsNone(CGOOBase(credentials, query_rate=None).bucket.rate)
+        self.assertEqual(CGOOBase(credentials).bucket.rate, 1)
+
+        cgoo = self.cgoo(query_rate=20)
+        start = time.monotonic()
+        for _ in range(5):
+            cgoo.query_unique_tags('000001')
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_reuse(self):
+        '''Queries should share the pool's connections'''
+        with mock.patch.object(
+                OfflineCGOO, '_connect', autospec=True,
+                side_effect=lambda c: OfflineConnection(
+                    c.credentials['database'])) as connect:
+            cgoo = self.cgoo(concurrency=2)
+            cgoo.map(cgoo.query_unique_tags, list(LOCATIONS) * 4)
+
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(cgoo._pool.qsize(), 2)
+
+    def test_collect(self):
+        '''Exceptions caught in the pool should reach the collector'''
+        cgoo = self.cgoo(concurrency=3)
+        with collect(logger, raise_errors=False) as errors:
+            cgoo.map(fail, range(6))
+        self.assertEqual(errors.total(), 6)
+
+    def test_concurrent(self):
+        '''Concurrent queries should give the sequential results'''
+        def get(cgoo):
+            return cgoo.map(lambda location: cgoo.get_timeseries(
+                location, enddatetime=self.enddatetime), LOCATIONS)
+
+        for expected, df in zip(get(self.cgoo()), get(self.cgoo(
+                concurrency=3))):
+            self.assertFalse(expected.empty)
+            pd.testing.assert_frame_equal(df, expected)
+
+
+class TestStreaming(CGOOTestCase):
+    history_kw = {'step': dt.timedelta(minutes=20)}
+
+    def test_equal(self):
+        '''Streamed tag files should equal get_timeseries and save_many'''
+        cgoo = self.cgoo()
+        cgoo.fetch_size = 100
+        (self.dstpath / 'memory').mkdir()
+        (self.dstpath / 'stream').mkdir()
+        for location in LOCATIONS:
+            df = cgoo.get_timeseries(location, enddatetime=self.enddatetime)
+            cgoo.save_many(self.tags(location), reldir='memory', df=df)
+            with mock.patch.object(
+                    cgoo, 'to_frame', wraps=cgoo.to_frame) as to_frame:
+                cgoo.stream_timeseries(
+                    location, self.tags(location),
+                    enddatetime=self.enddatetime, reldir='stream')
+            self.assertGreater(to_frame.call_count, len(cgoo.window_stats))
+
+        expected = self.outputs(self.dstpath / 'memory')
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(self.outputs(self.dstpath / 'stream'), expected)
+        self.assertEqual(list((self.dstpath / SCRATCH).iterdir()), [])
+
+        umask = os.umask(0)
+        os.umask(umask)
+        for path in (self.dstpath / 'stream').iterdir():
+            self.assertEqual(path.stat().st_mode & 0o777, 0o666 & ~umask)
+
+
+class TestCatalog(CGOOTestCase):
+    def test_concurrent_saves(self):
+        '''Catalogs saving to one path should keep each other's entries'''
+        path = self.path / 'catalog.json'
+
+        def save(location):
+            catalog = TagCatalog(path)
+            catalog.put(location, [f'{location}.tag'])
+            catalog.save()
+
+        locations = [f'{i:06}' for i in range(16)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(save, locations))
+
+        catalog = TagCatalog(path)
+        self.assertEqual(len(catalog), len(locations))
+        self.assertFalse(catalog.lockpath.exists())
+
+    def test_file_lock(self):
+        '''Held locks should time out, stale locks should be taken over'''
+        path = self.path / 'catalog.json.lock'
+        path.touch()
+        with self.assertRaises(TimeoutError):
+            with file_lock(path, timeout=0.1):
+                pass
+
+        os.utime(path, (time.time() - 3600, time.time() - 3600))
+        with file_lock(path, timeout=0.1):
+            self.assertTrue(path.exists())
+        self.assertFalse(path.exists())
+
+    def test_batched_saves(self):
+        '''Misses should be saved once with the catalog'''
+        path = self.path / 'catalog.json'
+        cgoo = self.cgoo(catalogpath=path)
+        with mock.patch.object(
+                TagCatalog, 'save', autospec=True,
+                side_effect=TagCatalog.save) as save:
+            for location in LOCATIONS:
+                cgoo.get_unique_tags(location)
+            self.assertFalse(path.exists())
+            cgoo.prefetch_unique_tags(LOCATIONS)
+        self.assertEqual(save.call_count, 1)
+
+        catalog = TagCatalog(path)
+        self.assertEqual(
+            {location: catalog.get(location) for location in LOCATIONS},
+            {location: set(tags) for location, tags in LOCATIONS.items()})
+
+
+class TestWindows(CGOOTestCase):
+    def test_adaptive(self):
+        '''Windows should adapt towards target_window_rows'''
+        cgoo = self.cgoo()
+        cgoo.target_window_rows = 500
+        cgoo.global_startdatetime = self.startdatetime
+        df = cgoo.get_timeseries('000001', enddatetime=self.enddatetime)
+
+        rows = [rows for *_, rows in cgoo.window_stats]
+        self.assertGreater(len(rows), 4)
+        for n in rows[1:-1]:
+            self.assertTrue(250 <= n <= 1000, rows)
+        self.assertEqual(len(df.drop_duplicates()), 2 * 24 * 92)
+
+    def test_exhausted(self):
+        '''A dry backfill should start later runs at the earliest'''
+        catalogpath = self.path / 'catalog.json'
+        cgoo = self.cgoo(catalogpath=catalogpath)
+        cgoo.global_startdatetime = dt.datetime(2022, 1, 1)
+        cgoo.get_timeseries('000001', enddatetime=self.enddatetime)
+        self.assertEqual(cgoo.catalog.earliest('000001'), self.startdatetime)
+        cgoo.catalog.save()
+
+        cgoo = self.cgoo(catalogpath=catalogpath)
+        cgoo.global_startdatetime = dt.datetime(2022, 1, 1)
+        cgoo.get_timeseries('000001', enddatetime=self.enddatetime)
+        self.assertEqual(cgoo.window_stats[-1][1], self.startdatetime)
+
+    def test_gap(self):
+        '''A gap shorter than the default window should not end a backfill'''
+        tags = {'000009': [TAG_FMT.format('000009', 'LT-1.LT-1_SI')]}
+        for start, end in ((self.startdatetime, dt.datetime(2023, 6, 10)),
+                           (dt.datetime(2023, 6, 13), self.enddatetime)):
+            generate_history(self.database, tags, start, end,
+                             step=dt.timedelta(minutes=10))
+
+        cgoo = self.cgoo()
+        cgoo.target_window_rows = 150
+        cgoo.global_startdatetime = dt.datetime(2022, 1, 1)
+        df = cgoo.get_timeseries('000009', enddatetime=self.enddatetime)
+
+        self.assertIn(0, [rows for *_, rows in cgoo.window_stats[:-2]])
+        self.assertEqual(df.dropna().DateTime.min(), self.startdatetime)
+        self.assertEqual(cgoo.catalog.earliest('000009'), self.startdatetime)
+
+
+class TestStore(CGOOTestCase):
+    def test_delta(self):
+        '''Updates should only query after the high-water mark'''
+        cgoo = self.cgoo(storepath=self.path / 'store.db')
+        cgoo.update('000001', enddatetime=dt.datetime(2023, 7, 10))
+        cgoo.reset_stats()
+        cgoo.update('000001', enddatetime=self.enddatetime)
+        self.assertEqual([window[1] for window in cgoo.window_stats],
+                         [dt.datetime(2023, 7, 10)])
+
+        df = cgoo.get_timeseries('000001', enddatetime=self.enddatetime)
+        expected = self.cgoo().get_timeseries(
+            '000001', enddatetime=self.enddatetime).drop_duplicates()
+        expected = expected[expected.DateTime > cgoo.global_startdatetime]
+        pd.testing.assert_frame_equal(
+            df.sort_values(['DateTime', 'TagName'], ignore_index=True),
+            expected.sort_values(['DateTime', 'TagName'], ignore_index=True))
+
+    def test_save(self):
+        '''Saving from the store should equal saving from memory'''
+        cgoo = self.cgoo(storepath=self.path / 'store.db')
+        memory = self.cgoo()
+        memory.global_startdatetime = dt.datetime(2023, 7, 1)
+        tags = self.tags('000002')
+        (self.dstpath / 'memory').mkdir()
+
+        cgoo.update('000002', enddatetime=self.enddatetime)
+        cgoo.save_many(tags, startdatetime=dt.datetime(2023, 7, 1))
+        memory.save_many(tags, reldir='memory', df=memory.get_timeseries(
+            '000002', enddatetime=self.enddatetime).drop_duplicates())
+
+        for tag in tags:
+            self.assertEqual(
+                (self.dstpath / tag.filename()).read_bytes(),
+                (self.dstpath / 'memory' / tag.filename()).read_bytes())
+
+    def test_save_missing(self):
+        '''Rows without a value should be saved like from memory'''
+        connection = sqlite3.connect(self.database)
+        with connection:
+            connection.execute(
+                'UPDATE history SET Value = NULL WHERE DateTime % 7 = 0')
+        connection.close()
+        cgoo = self.cgoo(storepath=self.path / 'store.db')
+        memory = self.cgoo()
+        tags = self.tags('000001')
+        (self.dstpath / 'memory').mkdir()
+
+        cgoo.update('000001', enddatetime=self.enddatetime)
+        cgoo.save_many(tags)
+        memory.save_many(tags, reldir='memory', df=memory.get_timeseries(
+            '000001', enddatetime=self.enddatetime).drop_duplicates())
+
+        for tag in tags:
+            saved = (self.dstpath / tag.filename()).read_bytes()
+            self.assertIn(b',\n', saved)
+            self.assertEqual(
+                saved, (self.dstpath / 'memory' / tag.filename()).read_bytes())
+
+
+class TestPartition(unittest.TestCase):
+    def test_select(self):
+        '''Selections should equal filtering and sorting'''
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({
+            'DateTime': pd.Timestamp('2023-01-01') + pd.to_timedelta(
+                rng.integers(0, 1000, 500), unit='h'),
+            'TagName': rng.choice(['a', 'b', 'c'], 500),
+            'Value': rng.normal(size=500),
+            })
+        partition = Partition(df)
+        after = dt.datetime(2023, 1, 20)
+        for tag in ('a', 'b', 'c', 'd'):
+            expected = df[(df.TagName == tag) & (df.DateTime > after)]\
+                .sort_values('DateTime', kind='stable')
+            pd.testing.assert_frame_equal(
+                partition.select(tag, after), expected)
@@ -0,0 +1,239 @@
+import gc
+import os
+import logging
+import unittest
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from fews_spoccer.utils import collect, SCRATCH
+from fews_spoccer.spoc.etypes import H2GOFileNotFoundException
+from fews_spoccer.modules.imports.h2go import H2GO, H2GOBatch, H2GOSummary
+
+
+logger = logging.getLogger(__name__)
+
+
+def write_h2go(filepath, datetimes, values=None, locid=1, mptid=2):
+    '''Write a H2GO file with DATUM and TIJD of datetimes'''
+    values = np.arange(len(datetimes)) / 4 if values is None else values
+    pd.DataFrame({
+        'LOCATIEID': locid,
+        'LOCATIE_NAAM': 'Kikkert, de',
+        'MEETPUNTID': mptid,
+        'WAARDE': values,
+        'DATUM': datetimes.strftime('%d-%m-%Y'),
+        'TIJD': datetimes.strftime('%H:%M:%S'),
+        }).to_csv(filepath, index=False)
+
+
+class H2GOTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.srcpath = Path(self.tmpdir.name) / 'src'
+        self.dstpath = Path(self.tmpdir.name) / 'dst'
+        self.srcpath.mkdir()
+        self.dstpath.mkdir()
+        self.config = {
+            'srcpath': self.srcpath,
+            'dstpath': self.dstpath,
+            'read_kw': {},
+            'write_kw': {'index': False},
+            }
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def convert(self, pattern, dstpath=None, **config):
+        '''Load and save pattern, returns the H2GO object and its output'''
+        dstpath = Path(dstpath or self.dstpath)
+        dstpath.mkdir(exist_ok=True)
+        obj = H2GO.load(pattern, {**self.config, 'dstpath': dstpath, **config})
+        obj.save()
+        return obj, (dstpath / obj.filepath.name).read_bytes()
+
+
+class TestChunks(H2GOTestCase):
+    def test_equal(self):
+        '''Chunked conversion should equal the in-memory conversion'''
+        datetimes = pd.date_range('2022-10-20', '2022-11-05', freq='13min')
+        values = np.arange(len(datetimes)).astype(object)
+        values[len(values) // 2:] = values[len(values) // 2:] / 3
+        write_h2go(self.srcpath / '1_2_x.csv', datetimes, values)
+
+        memory, expected = self.convert('1_2', self.dstpath / 'memory')
+        for chunksize in (7, 1000):
+            chunked, output = self.convert(
+                '1_2', self.dstpath / str(chunksize), chunksize=chunksize)
+            self.assertEqual(output, expected)
+            self.assertEqual(chunked.enddatetime, memory.enddatetime)
+
+    @mock.patch.multiple(H2GO, tz_in='Europe/Amsterdam', ambiguous='infer')
+    def test_days_kept_whole(self):
+        '''DST should be inferred over chunks, also without dict dtypes'''
+        datetimes = pd.date_range(
+            '2022-10-29', '2022-11-01', freq='10min', tz='utc')\
+            .tz_convert('Europe/Amsterdam').tz_localize(None)
+        write_h2go(self.srcpath / '1_2_x.csv', datetimes)
+
+        read_kw = {'dtype': object}
+        _, expected = self.convert(
+            '1_2', self.dstpath / 'memory', read_kw=read_kw)
+        chunked, output = self.convert('1_2', chunksize=5, read_kw=read_kw)
+        self.assertEqual(output, expected)
+        self.assertEqual(set(chunked.dtypes.values()), {'object'})
+
+    def test_mode(self):
+        '''Chunked outputs should get the mode of a file written in place'''
+        datetimes = pd.date_range('2022-01-01', '2022-01-03', freq='10min')
+        write_h2go(self.srcpath / '1_2_x.csv', datetimes)
+        umask = os.umask(0)
+        os.umask(umask)
+
+        obj, _ = self.convert('1_2', chunksize=10)
+        self.assertEqual(obj.outpath.stat().st_mode & 0o777, 0o666 & ~umask)
+        self.assertEqual(obj.tmppath, None)
+        self.assertEqual(list((self.dstpath / SCRATCH).iterdir()), [])
+
+        os.chmod(obj.outpath, 0o640)
+        self.convert('1_2', chunksize=10)
+        self.assertEqual(obj.outpath.stat().st_mode & 0o777, 0o640)
+
+    def test_unsaved(self):
+        '''Unsaved conversions should leave no files in dstpath'''
+        datetimes = pd.date_range('2022-01-01', '2022-01-03', freq='10min')
+        write_h2go(self.srcpath / '1_2_x.csv', datetimes)
+
+        obj = H2GO.load('1_2', {**self.config, 'chunksize': 10})
+        self.assertTrue(obj.tmppath.exists())
+        del obj
+        gc.collect()
+        self.assertEqual(
+            [p.name for p in self.dstpath.rglob('*') if p.is_file()], [])
+
+
+class TestIncremental(H2GOTestCase):
+    def setUp(self):
+        super().setUp()
+        self.filepath = self.srcpath / '1_2_x.csv'
+        write_h2go(self.filepath, pd.date_range(
+            '2022-01-01', '2022-01-02 23:50', freq='10min'))
+
+    def append(self, datetimes):
+        with open(self.filepath, 'a', newline='') as f:
+            pd.DataFrame({'a': [1], 'b': ['x'], 'c': [2], 'd': [0.5],
+                          'e': datetimes.strftime('%d-%m-%Y'),
+                          'f': datetimes.strftime('%H:%M:%S')})\
+                .to_csv(f, header=False, index=False)
+
+    def test_append(self):
+        '''Appended rows should give the output of a full rebuild'''
+        for chunksize, datetime in ((None, '2022-01-03'), (10, '2022-01-04')):
+            dstpath = self.dstpath / str(chunksize)
+            config = {'chunksize': chunksize, 'incremental': True}
+            self.convert('1_2', dstpath, **config)
+            self.append(pd.DatetimeIndex([datetime]))
+
+            obj, output = self.convert('1_2', dstpath, **config)
+            _, expected = self.convert('1_2', self.dstpath / 'full')
+            self.assertTrue(obj.appending)
+            self.assertEqual(output, expected)
+
+    def test_rebuild(self):
+        '''Rewritten sources should be converted in full'''
+        config = {'incremental': True}
+        self.convert('1_2', **config)
+        write_h2go(self.filepath, pd.date_range(
+            '2022-01-01', '2022-01-03', freq='10min'), values=1.5)
+
+        obj, output = self.convert('1_2', **config)
+        _, expected = self.convert('1_2', self.dstpath / 'full')
+        self.assertFalse(obj.appending)
+        self.assertEqual(output, expected)
+
+    def test_source_datum(self):
+        '''The last DATUM should be recorded as in the source'''
+        for chunksize in (None, 10):
+            obj, _ = self.convert('1_2', self.dstpath / str(chunksize),
+                                  chunksize=chunksize, incremental=True)
+            self.assertEqual(obj.read_meta()['datum'], '02-01-2022')
+
+
+class TestSummary(H2GOTestCase):
+    def test_equal(self):
+        '''Summaries should give the period of the conversion'''
+        datetimes = pd.date_range('2022-10-29', '2022-11-02', freq='7min')
+        filepath = self.srcpath / '1_2_x.csv'
+        write_h2go(filepath, datetimes)
+
+        obj, _ = self.convert('1_2')
+        for blocksize in (64, 1000, 2**16):
+            with mock.patch.object(H2GOSummary, 'blocksize', blocksize):
+                summary = H2GOSummary(filepath, {})
+            self.assertEqual(summary.startdatetime, obj.startdatetime)
+            self.assertEqual(summary.enddatetime, obj.enddatetime)
+            self.assertEqual(summary.columns, list(obj.df.columns))
+
+    def test_cached(self):
+        '''Summaries should be reread when their file changes'''
+        filepath = self.srcpath / '1_2_x.csv'
+        write_h2go(filepath, pd.date_range('2022-01-01', periods=10))
+        summary = H2GOSummary.get(filepath, {})
+        self.assertIs(H2GOSummary.get(filepath, {}), summary)
+
+        write_h2go(filepath, pd.date_range('2022-01-01', periods=20))
+        self.assertEqual(H2GOSummary.get(filepath, {}).enddatetime,
+                         H2GO.load('1_2', self.config).enddatetime)
+
+    def test_empty(self):
+        '''Files without rows should have no period'''
+        filepath = self.srcpath / '1_2_x.csv'
+        write_h2go(filepath, pd.DatetimeIndex([]))
+        summary = H2GOSummary(filepath, {})
+        self.assertIsNone(summary.enddatetime)
+        self.assertIn('DATUM', summary.columns)
+
+
+class TestBatch(H2GOTestCase):
+    def setUp(self):
+        super().setUp()
+        datetimes = pd.date_range('2022-01-01', '2022-01-03', freq='10min')
+        for locid in (1, 3):
+            write_h2go(self.srcpath / f'{locid}_2_x.csv', datetimes,
+                       locid=locid)
+
+    def test_workers(self):
+        '''Worker processes should give the in-process results'''
+        patterns = ['1_2', '3_2', '5_2', '1_2']
+        results = []
+        for workers in (1, 2):
+            dstpath = self.dstpath / str(workers)
+            dstpath.mkdir()
+            batch = H2GOBatch({**self.config, 'dstpath': dstpath}, workers)
+            objects, errors = batch.run(patterns, save=True)
+            results.append((objects, errors, sorted(
+                (p.name, p.read_bytes()) for p in dstpath.iterdir())))
+
+        (objects, errors, output), (objects_, errors_, output_) = results
+        self.assertEqual(list(objects), ['1_2', '3_2'])
+        self.assertEqual(list(objects_), list(objects))
+        self.assertIsInstance(errors_['5_2'], H2GOFileNotFoundException)
+        self.assertEqual(list(errors_), list(errors))
+        self.assertEqual(len(output), 2)
+        self.assertEqual(output_, output)
+        for pattern, obj in objects.items():
+            pd.testing.assert_frame_equal(objects_[pattern].df, obj.df)
+
+    @mock.patch.dict(os.environ, {'RAISE': '0'})
+    def test_collect(self):
+        '''Exceptions caught in workers should reach the collector'''
+        batch = H2GOBatch(self.config, workers=2)
+        with collect(logger) as errors:
+            objects, failed = batch.run(['1_2', '5_2'])
+        self.assertEqual(failed, {})
+        self.assertEqual(errors.total(), 1)
+        self.assertEqual(errors.to_frame().exception.tolist(),
+                         ['H2GOFileNotFoundException'])
@@ -0,0 +1,126 @@
+import shutil
+import unittest
+import tempfile
+import datetime as dt
+from pathlib import Path
+from unittest import mock
+
+from fews_spoccer.spoc.spoccer import Spoccer
+from fews_spoccer.spoc.dtypes import Tag
+from fews_spoccer.modules.imports.h2go import H2GO
+from fews_spoccer.modules.imports.offline import (
+    OfflineCGOO, OfflineOpvlWaterModule, generate_history)
+
+
+read_kw = {
+    'sep': ';',
+    'index_col': False,
+    'dtype': object,
+    'na_values': [''],
+    'keep_default_na': False,
+    'encoding': 'cp1252',
+}
+write_kw = {
+    'sep': ';',
+    'index': False,
+    'encoding': 'cp1252'
+    }
+
+srcdir = './tests/data/maplayerfiles'
+importdir = './tests/data/imports'
+
+
+class TestRunModules(unittest.TestCase):
+    ids = ['HL000562', 'HL000564']
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name)
+        self.srcpath = self.path / 'maplayerfiles'
+        self.dstpath = self.path / 'imports'
+        shutil.copytree(srcdir, self.srcpath)
+        self.dstpath.mkdir()
+
+        self.spoccer = Spoccer(self.srcpath, self.srcpath, read_kw, write_kw)
+        self.spoccer.load()
+        tags = Tag.table(self.spoccer.hl.param_matches().df.tag)
+        self.database = self.path / 'history.db'
+        generate_history(
+            self.database,
+            {location: list(g.index)
+             for location, g in tags.groupby('location')},
+            dt.datetime(2023, 1, 1), dt.datetime(2023, 2, 1),
+            step=dt.timedelta(hours=6))
+
+        self.spoccer.load_module(
+            OfflineOpvlWaterModule,
+            h2go_config={'srcpath': importdir, 'dstpath': self.dstpath,
+                         'read_kw': {}, 'write_kw': {'index': False}},
+            cgoo_config={'dstpath': self.dstpath,
+                         'credentials': {'database': self.database},
+                         'write_kw': {'index': False}})
+        self.spoccer.module.cgoo.global_startdatetime = \
+            dt.datetime(2023, 1, 1)
+
+    def tearDown(self):
+        for connection in self.spoccer.module.cgoo._connections:
+            connection.close()
+        self.tmpdir.cleanup()
+
+    def test_failing_location(self):
+        '''A failing tag query should only fail the ids at its location'''
+        query = OfflineCGOO.query_unique_tags
+
+        def query_unique_tags(cgoo, location):
+            if location == '042745':
+                raise ConnectionError(location)
+            return query(cgoo, location)
+
+        with mock.patch.object(OfflineCGOO, 'query_unique_tags',
+                               query_unique_tags):
+            errors = self.spoccer.run_modules(self.ids, 'oc_test')
+
+        self.assertEqual(list(errors), ['HL000564'])
+        self.assertIsInstance(errors['HL000564'], ConnectionError)
+        status = self.spoccer.sync_status('oc_test')
+        self.assertEqual(status.loc['HL000562', 'oc_test'], 'LIVE')
+        self.assertNotEqual(status.loc['HL000564', 'oc_test'], 'LIVE')
+
+        spoccer = Spoccer(self.srcpath, self.srcpath, read_kw, write_kw)
+        spoccer.load()
+        self.assertEqual(
+            spoccer.sync_status('oc_test').loc['HL000562', 'oc_test'],
+            'LIVE')
+        self.assertTrue(any(self.dstpath.glob('*46052*')))
+
+    def test_failing_stage(self):
+        '''A failing batch-wide H2GO stage should not stop the batch'''
+        def load_h2go(module, indexers):
+            raise OSError('h2go')
+
+        with mock.patch.object(OfflineOpvlWaterModule, 'load_h2go',
+                               load_h2go):
+            errors = self.spoccer.run_modules(self.ids, 'oc_test')
+
+        self.assertEqual(errors, {})
+        status = self.spoccer.sync_status('oc_test')
+        self.assertEqual(status.loc[self.ids, 'oc_test'].tolist(),
+                         ['LIVE', 'LIVE'])
+
+    def test_convert_written(self):
+        '''Only the H2GO files that will be written should be converted'''
+        validate = H2GO.validate
+        patterns = []
+
+        def record(h2go, pattern):
+            patterns.append(pattern)
+            return validate(h2go, pattern)
+
+        with mock.patch.object(H2GO, 'validate', record):
+            errors = self.spoccer.run_modules(self.ids, 'oc_test')
+
+        self.assertEqual(errors, {})
+        self.assertEqual(sorted(patterns), sorted(
+            path.name.split('_Kikkert')[0]
+            for path in self.dstpath.glob('6677_*.csv')))
+        self.assertFalse(any(self.dstpath.glob('17304_*')))
@@ -1,9 +1,23 @@
+import os
+import shutil
+import logging
 import unittest
 import filecmp
+import threading
 from pathlib import Path
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
 
+from fews_spoccer.utils import profile, collect
 from fews_spoccer.spoc.spoccer import Spoccer
+from fews_spoccer.spoc.dtypes import Tag
+from fews_spoccer.spoc.indexer import Matches
+from fews_spoccer.spoc.ctypes import SLColumn, TagParam
+from fews_spoccer.spoc.etypes import (
+    InvalidPatternException, SpocFileValidationException)
 
 
 read_kw = {
@@ -36,3 +50,374 @@ class TestSpoccer(unittest.TestCase):
         dstfiles = sorted(list(Path(dstdir).iterdir()))
         for srcfile, dstfile in zip(srcfiles, dstfiles):
             self.assertTrue(filecmp.cmp(srcfile, dstfile))
+
+    def test_save_dirty(self):
+        '''Only modified SpocFiles should be written on save'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+        self.spoccer.save()
+        self.assertFalse(any(s.is_dirty(dstdir) for s in self.spoccer))
+
+        self.spoccer.ws_tags.oc_test.set_field('OW000001', 'LIVE')
+        dirty = [str(s) for s in self.spoccer if s.is_dirty(dstdir)]
+        self.assertEqual(dirty, ['ws_tags'])
+
+    def test_save_unchanged(self):
+        '''Files equal to the loaded tree should not be written'''
+        copydir = Path('./tests/output/copy_maplayerfiles')
+        shutil.rmtree(copydir, ignore_errors=True)
+        shutil.copytree(srcdir, copydir)
+
+        self.spoccer = Spoccer(srcdir, copydir, read_kw, write_kw)
+        self.spoccer.load()
+        with mock.patch.object(
+                type(self.spoccer.hl), 'write', autospec=True) as write:
+            self.spoccer.save()
+        write.assert_not_called()
+        with mock.patch('filecmp.cmp', wraps=filecmp.cmp) as cmp:
+            self.spoccer.save()
+        cmp.assert_not_called()
+
+        # direct modifications are seen, and reverting them is not
+        hl = self.spoccer.hl
+        value = hl.df.iloc[0, 1]
+        hl.df.iloc[0, 1] = 'x'
+        self.assertTrue(hl.is_dirty(copydir))
+        hl.df.iloc[0, 1] = value
+        self.assertFalse(hl.is_dirty(copydir))
+
+    def test_save_mode(self):
+        '''Saved files should keep their mode, new files the umask's'''
+        modedir = Path('./tests/output/mode_maplayerfiles')
+        shutil.rmtree(modedir, ignore_errors=True)
+        modedir.mkdir(parents=True)
+        (modedir / 'HL.csv').touch()
+        os.chmod(modedir / 'HL.csv', 0o640)
+
+        self.spoccer = Spoccer(srcdir, modedir, read_kw, write_kw)
+        self.spoccer.load()
+        self.spoccer.save()
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual((modedir / 'HL.csv').stat().st_mode & 0o777, 0o640)
+        self.assertEqual((modedir / 'SL.csv').stat().st_mode & 0o777,
+                         0o666 & ~umask)
+        self.assertEqual(sorted(p.name for p in modedir.iterdir()),
+                         sorted(p.name for p in Path(srcdir).iterdir()))
+
+    def test_groups(self):
+        '''Lookups by parent id should follow set_value and reads'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+        sl = self.spoccer.hl.sl
+        id = sl.df.index[0]
+
+        sl.pid.set_field(id, 'HL999999')
+        self.assertEqual(sl.ids_by_pids('HL999999').tolist(), [id])
+
+        sl.read(srcdir, **read_kw)
+        sl.set_index()
+        self.assertEqual(sl.ids_by_pids('HL999999').tolist(), [])
+
+    def test_rows(self):
+        '''Rows of non-unique ids should equal a scan of the index'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+        for spocfile in (self.spoccer.damo_pomp, self.spoccer.ws_validatie):
+            ids = spocfile.df.index[spocfile.df.index.duplicated()][:2]
+            self.assertGreater(len(ids), 0)
+            self.assertIsNotNone(spocfile._groups)
+            pd.testing.assert_frame_equal(
+                spocfile.rows(*ids), spocfile.df[spocfile.df.index.isin(ids)])
+
+    def test_sublocations_many(self):
+        '''Bulk lookups should equal single ones and skip unknown ids'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+        ids = ['HL000562', 'XX000001', 'HL000564']
+        indexers = self.spoccer.hl.sublocations_many(ids)
+
+        self.assertEqual(list(indexers), ['HL000562', 'HL000564'])
+        for id, indexer in indexers.items():
+            self.assertEqual(
+                [i.id for i in indexer],
+                [i.id for i in self.spoccer.hl.sublocations(id)])
+
+    def test_sync_levels(self):
+        '''Bulk sync level updates should show in the status'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+
+        rejected = self.spoccer.set_sync_levels(
+            ['HL000562', 'HL000564'], 'VALIDATIE', 'oc_test')
+        self.assertEqual(rejected.tolist(), ['HL000562', 'HL000564'])
+
+        self.spoccer.set_sync_levels(['HL000562'], 'LIVE', 'oc_test')
+        status = self.spoccer.sync_status('oc_test')
+        self.assertEqual(status.loc['HL000562', 'oc_test'], 'LIVE')
+        self.assertEqual(status.loc['HL000562', 'oc_test_next'], 'VALIDATIE')
+        self.assertTrue(pd.isna(status.loc['HL000564', 'oc_test']))
+
+    @mock.patch.dict(os.environ, {'RAISE': '0'})
+    def test_validate_cached_failures(self):
+        '''SpocFiles with failures should not be cached as validated'''
+        baddir = Path('./tests/output/bad_maplayerfiles')
+        cachedir = Path('./tests/output/cache')
+        shutil.rmtree(baddir, ignore_errors=True)
+        shutil.rmtree(cachedir, ignore_errors=True)
+        shutil.copytree(srcdir, baddir)
+        hl = baddir / 'HL.csv'
+        hl.write_text(hl.read_text(encoding='cp1252').replace(
+            'HL000001', 'XX000001', 1), encoding='cp1252')
+
+        for _ in range(2):
+            spoccer = Spoccer(baddir, dstdir, read_kw, write_kw,
+                              cachepath=cachedir)
+            spoccer.load()
+            spoccer.validate()
+            self.assertEqual(len(spoccer.errors), 1)
+            self.assertFalse(spoccer.hl.validated)
+
+    def test_validate_policy(self):
+        '''Vectorized validate should raise or collect like per cell'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        self.spoccer.load()
+        self.spoccer.hl.df.iloc[0, 1] = 'XX000001'
+        id = self.spoccer.hl.df.index[0]
+
+        with mock.patch.dict(os.environ, {'RAISE': '1'}):
+            with self.assertRaises(InvalidPatternException):
+                self.spoccer.validate()
+            with self.assertRaises(SpocFileValidationException) as e:
+                self.spoccer.validate(vectorized=True)
+        self.assertEqual(e.exception.args[1].id.unique().tolist(), [id])
+
+        with mock.patch.dict(os.environ, {'RAISE': '0'}):
+            report = self.spoccer.validate(vectorized=True)
+            self.spoccer.validate()
+        self.assertEqual(report.id.unique().tolist(), [id])
+        self.assertEqual(len(self.spoccer.errors), 1)
+
+    def test_load_concurrent(self):
+        '''Concurrent load should equal the sequential load'''
+        sequential = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        sequential.load()
+        concurrent = Spoccer(srcdir, dstdir, read_kw, write_kw, workers=4)
+        concurrent.load()
+
+        for a, b in zip(sequential, concurrent):
+            pd.testing.assert_frame_equal(a.df, b.df)
+
+    def test_profile(self):
+        '''Annotated calls within a profile should be recorded'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        with profile(logging.getLogger(__name__)) as stats:
+            self.spoccer.load()
+
+        df = stats.to_frame()
+        self.assertEqual(df.loc['spoccer.Spoccer.load', 'calls'], 1)
+        self.assertEqual(df.exceptions.sum(), 0)
+        self.assertFalse(stats.enabled)
+
+    def test_profile_nested(self):
+        '''Nested profiles should each record the calls in their block'''
+        self.spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        with profile(logging.getLogger(__name__)) as outer:
+            self.spoccer.load()
+            with profile(logging.getLogger(__name__)) as inner:
+                self.spoccer.load()
+            self.assertTrue(outer.enabled)
+
+        self.assertEqual(outer.to_frame().loc['spoccer.Spoccer.load',
+                                              'calls'], 2)
+        self.assertEqual(inner.to_frame().loc['spoccer.Spoccer.load',
+                                              'calls'], 1)
+
+
+class TestColumn(unittest.TestCase):
+    @mock.patch.dict(os.environ, {'RAISE': '0'})
+    def test_check(self):
+        '''Vectorized checks should report every failing id'''
+        series = pd.Series(
+            ['SL000001', 'SL00002', np.nan, 'SL000001'],
+            index=['a', 'b', 'c', 'd'])
+        report = SLColumn('CODE').check(series)
+
+        failed = report.groupby('exception').id.apply(list).to_dict()
+        self.assertEqual(failed, {
+            'InvalidPatternException': ['b'],
+            'NonUniqueException': ['a', 'd'],
+            'EmptyFieldException': ['c']})
+
+    @mock.patch.dict(os.environ, {'RAISE': '0'})
+    def test_check_tags(self):
+        '''Non-taglike values pass, invalid tags are reported'''
+        tag = (r'''~SCX.~Watersysteem.Objecten.Vijfheerenlanden.Kikkert'''
+               r''', de.Tags.NL*09*001596 wtSTLT-1002.LT-1002_SI.Historic''')
+        series = pd.Series([tag, 'no tag', tag.replace('Historic', 'H')])
+        report = TagParam('TAG_CGOO_MNAP', param='HM').check(series)
+
+        self.assertEqual(report.id.tolist(), [2])
+
+    def test_collect(self):
+        '''Caught exceptions should be collected once per cell'''
+        series = pd.Series(['SL000001', 'SL00002', np.nan, 'SL00003'],
+                           index=['a', 'b', 'c', 'd'])
+        column = SLColumn('CODE')
+        with collect(logging.getLogger(__name__), raise_errors=False) as e:
+            column.validate(series)
+            column.validate(series)
+
+        df = e.to_frame().set_index('id')
+        self.assertEqual(df.exception.to_dict(), {
+            'b': 'InvalidPatternException',
+            'd': 'InvalidPatternException',
+            'c': 'EmptyFieldException'})
+        self.assertEqual(df['count'].tolist(), [2, 2, 2])
+
+    def test_collect_threads(self):
+        '''Concurrent collect blocks should each keep their own records'''
+        barrier = threading.Barrier(2)
+
+        def validate(value):
+            series = pd.Series([value], index=[value])
+            with collect(logging.getLogger(__name__),
+                         raise_errors=False) as e:
+                barrier.wait()
+                SLColumn('CODE').validate(series)
+                barrier.wait()
+            return e.to_frame().id.tolist()
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            ids = list(executor.map(validate, ['a', 'b']))
+        self.assertEqual(ids, [['a'], ['b']])
+
+    @mock.patch.dict(os.environ, {'RAISE': '1'})
+    def test_check_raise(self):
+        '''Vectorized checks should report every column, also if raising'''
+        series = pd.Series(['SL000001', 'SL00002', 'SL000001'],
+                           index=['a', 'b', 'c'])
+        report = SLColumn('CODE').check(series)
+        self.assertEqual(report.id.tolist(), ['b', 'a', 'c'])
+
+        with self.assertRaises(InvalidPatternException):
+            SLColumn('CODE').validate(series)
+
+    def test_collect_paths(self):
+        '''Per cell and vectorized checks should collect the same records'''
+        series = pd.Series(['SL000001', 'SL00002', np.nan, 'SL000001'],
+                           index=['a', 'b', 'c', 'd'])
+        column = SLColumn('CODE')
+        records = []
+        for vectorized in (False, True):
+            with collect(logging.getLogger(__name__),
+                         raise_errors=False) as e:
+                column.validate(series, vectorized)
+            df = e.to_frame()
+            records.append(sorted(zip(df.id, df.exception)))
+
+        self.assertEqual(records[0], records[1])
+        self.assertIn(('d', 'NonUniqueException'), records[0])
+
+
+class TestRegistry(unittest.TestCase):
+    def test_relations(self):
+        '''Params should relate to the TagParams of their param'''
+        registry = Spoccer(srcdir, dstdir, read_kw, write_kw).registry
+        self.assertEqual(registry.related('sl')[0], 'sl')
+        self.assertIn('sl_tags', registry.related('sl'))
+        self.assertEqual(registry.matches, {
+            'sl': ('sl_ti_h2go_tags', 'sl_tags'),
+            'ws': ('ws_ti_h2go_tags', 'ws_tags')})
+
+        for param, tagparam in registry.relations.items():
+            parent = registry.parents[str(registry.owners[param])]
+            self.assertEqual(param.param, tagparam.param)
+            self.assertEqual(registry.matches[parent][1],
+                             str(registry.owners[tagparam]))
+        self.assertEqual(registry.tag_params('ws_ti_h2go_tags'), {
+            'TAG_CGOO_MNAP': 'HM', 'TAG_CGOO_Q': 'QM'})
+        self.assertIs(registry['ws'].registry, registry)
+
+
+class TestTag(unittest.TestCase):
+    tag = (r'''~SCX.~Watersysteem.Objecten.Vijfheerenlanden.Kikkert'''
+           r''', de.Tags.NL*09*001596 wtSTLT-1002.LT-1002_SI.Historic''')
+
+    def test_parse_cached(self):
+        '''Tags should be parsed once, also by table'''
+        self.assertIs(Tag.parse(self.tag), Tag.parse(self.tag))
+
+        hits = Tag._parse.cache_info().hits
+        Tag.table(pd.Series([self.tag]))
+        self.assertEqual(Tag._parse.cache_info().hits, hits + 1)
+        self.assertIsNotNone(Tag._parse.cache_info().maxsize)
+
+    def test_table(self):
+        '''Unique tags are parsed into a table, other values left out'''
+        table = Tag.table(pd.Series([self.tag, self.tag, 'no tag', np.nan]))
+
+        self.assertEqual(table.index.tolist(), [self.tag])
+        self.assertEqual(table.loc[self.tag, 'location'], '001596')
+        self.assertEqual(table.loc[self.tag, 'filename'],
+                         Tag.parse(self.tag).filename())
+
+
+class TestMatches(unittest.TestCase):
+    def test_masks(self):
+        '''Masks should select matched and unmatched pairs'''
+        matches = Matches(pd.DataFrame({
+            'id': ['OW000001', 'OW000001', 'OW000002'],
+            'param': ['HM', 'QM', 'HM'],
+            'file': ['6677_46052', np.nan, np.nan],
+            'tag': ['tag', 'tag', np.nan]}), {})
+
+        self.assertEqual(
+            matches.exists_all(['file', 'tag']).tolist(), [True, False, False])
+        self.assertEqual(
+            matches.is_empty(['file', 'tag']).tolist(), [False, False, True])
+        self.assertEqual(
+            matches.select_ids('OW000002').df.param.tolist(), ['HM'])
+
+    def test_tree(self):
+        '''Index data should equal per cell lookups of the data tree'''
+        spoccer = Spoccer(srcdir, dstdir, read_kw, write_kw)
+        spoccer.load()
+
+        def cell(spocfile, column, index):
+            if index.id not in spocfile.df.index:
+                return np.nan
+            return column.__get__(spocfile).field(index)
+
+        def lookup(index):
+            filefile, tagfile = (
+                spoccer.registry[s] for s in index.spocfiles[::-1])
+            tagparams = {p.param: p for p in tagfile.Params}
+            for p in filefile.Params:
+                locid = cell(filefile, filefile.h2go_locid, index)
+                file = cell(filefile, p, index)
+                tag = np.nan
+                if p.relation is not None:
+                    tag = cell(tagfile, tagparams[p.param], index)
+                yield (index.id, p.param,
+                       np.nan if pd.isna(locid) else locid.concat(file), tag)
+
+        def normalize(rows):
+            return [tuple(None if pd.isna(v) else getattr(v, 'tag', v)
+                          for v in row) for row in rows]
+
+        indexers = [spoccer.hl.get_param_matches(spoccer.hl.sublocations(id))
+                    for id in spoccer.hl.df.index]
+        fields, n = 0, 0
+        for indexer in indexers:
+            for index in indexer.sublocations():
+                filefile, tagfile = index.spocfiles[::-1]
+                data = [(f['id'], f['param'], f[filefile], f[tagfile])
+                        for f in index]
+                self.assertEqual(normalize(data),
+                                 normalize(lookup(index)), index)
+                fields += sum(pd.notna(row[3]) for row in data)
+                n += 1
+        self.assertGreater(n, 0)
+        self.assertGreater(fields, 0)